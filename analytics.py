@@ -0,0 +1,143 @@
+import threading
+
+import numpy as np
+
+from columnar import rows_to_columns
+from history import ist_day_start
+
+BUILD_UPS = {
+    (True, True): 'Long Build-up',
+    (False, True): 'Short Build-up',
+    (True, False): 'Short Covering',
+    (False, False): 'Long Unwinding',
+}
+
+
+def classify_build_up(price_change, oi_change):
+    """Classic price/OI quadrant for one option leg."""
+    if price_change == 0 or oi_change == 0:
+        return 'Neutral'
+    return BUILD_UPS[(price_change > 0, oi_change > 0)]
+
+
+def max_pain(strikes, ce_oi, pe_oi):
+    """Strike at which option writers pay out the least if the underlying expires there."""
+    strikes = np.asarray(strikes, dtype=float)
+    if strikes.size == 0:
+        return None
+    # payout[i] = total intrinsic value owed if the underlying settles at strikes[i]
+    settle = strikes[:, None]
+    payout = (
+        np.maximum(settle - strikes, 0) @ np.asarray(ce_oi, dtype=float)
+        + np.maximum(strikes - settle, 0) @ np.asarray(pe_oi, dtype=float)
+    )
+    return float(strikes[np.argmin(payout)])
+
+
+def oi_totals(ce_oi, pe_oi, ce_change, pe_change):
+    total_ce_oi, total_pe_oi = float(np.sum(ce_oi)), float(np.sum(pe_oi))
+    total_ce_change, total_pe_change = float(np.sum(ce_change)), float(np.sum(pe_change))
+    return {
+        'CEOI': total_ce_oi,
+        'PEOI': total_pe_oi,
+        'CE-CH-OI': total_ce_change,
+        'PE-CH-OI': total_pe_change,
+        'OI Diff': total_pe_oi - total_ce_oi,
+        'PCR': total_pe_oi / total_ce_oi if total_ce_oi else 0,
+        'Trending OI': total_pe_change - total_ce_change,
+    }
+
+
+# Session aggregates per (underlying, expiry), updated once per published
+# snapshot so /api/analytics never rescans history. State resets at the
+# start of each IST trading day.
+#
+# Totals, PCR (and its session range), max pain and the build-up cover the
+# full chain; `window_totals` covers the default ATM window on display.
+class SessionAnalytics:
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def update(self, document):
+        key = (document['underlying'], document['expiry'])
+        day_start = ist_day_start(document['timestamp'])
+        rows = document['data']
+
+        chain = document.get('chain') or rows_to_columns(rows)
+        fields = chain['fields']
+
+        def column(name):
+            return np.nan_to_num(np.asarray(fields[name], dtype=float))
+
+        strikes = chain['strikes']
+        ce_oi, pe_oi = column('CEOI'), column('PEOI')
+        ce_change, pe_change = column('CE-CH-OI'), column('PE-CH-OI')
+        ce_ltp, pe_ltp = column('CLTP'), column('PLTP')
+        totals = oi_totals(ce_oi, pe_oi, ce_change, pe_change)
+        pcr = totals['PCR']
+        pain = max_pain(strikes, ce_oi, pe_oi)
+        window_totals = oi_totals(
+            [row.get('CEOI') or 0 for row in rows], [row.get('PEOI') or 0 for row in rows],
+            [row.get('CE-CH-OI') or 0 for row in rows], [row.get('PE-CH-OI') or 0 for row in rows],
+        )
+
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None or session['day_start'] != day_start:
+                session = self._sessions[key] = {
+                    'day_start': day_start,
+                    'opening_ltp': {},
+                    'pcr_high': None,
+                    'pcr_low': None,
+                    'snapshots': 0,
+                }
+            if session.get('timestamp') is not None and document['timestamp'] <= session['timestamp']:
+                return
+
+            timestamp = document['timestamp']
+            if session['pcr_high'] is None or pcr > session['pcr_high']['value']:
+                session['pcr_high'] = {'value': pcr, 'timestamp': timestamp}
+            if session['pcr_low'] is None or pcr < session['pcr_low']['value']:
+                session['pcr_low'] = {'value': pcr, 'timestamp': timestamp}
+
+            # Price moves are measured from the session's first snapshot, which seeds
+            # every strike of the chain (strikes listed later from when they first
+            # appear), OI moves from the previous day's close (the CH-OI columns)
+            opening_ltp = session['opening_ltp']
+            build_up = {}
+            for i, strike in enumerate(strikes):
+                opening = opening_ltp.setdefault(strike, (ce_ltp[i], pe_ltp[i]))
+                build_up[str(strike)] = {
+                    'CE': classify_build_up(ce_ltp[i] - opening[0], ce_change[i]),
+                    'PE': classify_build_up(pe_ltp[i] - opening[1], pe_change[i]),
+                }
+
+            session.update({
+                'timestamp': timestamp,
+                'atm_strike': document['atm_strike'],
+                'snapshots': session['snapshots'] + 1,
+                'totals': totals,
+                'window_totals': window_totals,
+                'max_pain': pain,
+                'build_up': build_up,
+            })
+
+    def get(self, underlying, expiry):
+        with self._lock:
+            session = self._sessions.get((underlying, expiry))
+            if session is None or 'timestamp' not in session:
+                return None
+            return {
+                'underlying': underlying,
+                'expiry': expiry,
+                'timestamp': session['timestamp'],
+                'atm_strike': session['atm_strike'],
+                'snapshots': session['snapshots'],
+                'totals': dict(session['totals']),
+                'window_totals': dict(session['window_totals']),
+                'session_pcr_high': dict(session['pcr_high']),
+                'session_pcr_low': dict(session['pcr_low']),
+                'max_pain': session['max_pain'],
+                'build_up': dict(session['build_up']),
+            }
@@ -1,22 +1,138 @@
-from flask import Flask, render_template, jsonify, make_response
-import pandas as pd
+from flask import Flask, Response, render_template, jsonify, make_response, request, g
 from dhanhq import dhanhq
-import time
 import logging
 from apscheduler.schedulers.background import BackgroundScheduler
 from pymongo import MongoClient
+from pymongo.errors import ConnectionFailure, PyMongoError
 from datetime import datetime, timedelta
 import pytz
 import os
+import atexit
+import threading
+import time
+from snapshot_cache import SnapshotRegistry
+from broadcaster import Broadcaster, sse_message
+from payload import FORMATS, snapshot_id
+from columnar import build_chain, with_window
+from transform import detect_interval
+from greeks import GreeksEngine, years_to_expiry
+from instruments import INSTRUMENTS, DEFAULT_UNDERLYING, get_instrument
+from fetcher import OptionChainFetcher
+from clients import MONGO_TIMEOUT_MS
+from dhan_async import DhanClient
+from resilience import CircuitOpenError, retry_delay
+from storage import SnapshotStore
+from leader import LeaderLock
+from analytics import SessionAnalytics
+from page_cache import PageCache
+from warm_start import WarmStartFile
+from history import IntradayHistory, RESOLUTIONS, ist_day_start, query_buckets, to_millis
+from market_calendar import MarketCalendar, OPEN, POST_CLOSE, PRE_OPEN
+import upload
+from metrics import (REGISTRY, CallbackMetric, HTTP_REQUEST_SECONDS, MONGO_INSERT_SECONDS, REFRESH_FAILURES,
+                     REFRESH_RETRIES, STREAMS_REJECTED, TRANSFORM_SECONDS, RequestProfiler)
 
 # Initialize Flask application
 app = Flask(__name__)
 
 # MongoDB client setup
-client = MongoClient('mongodb://localhost:27017/')  # Replace with your MongoDB URI if using a cloud-hosted MongoDB
+# Short timeouts: during an outage requests fall back to the in-memory snapshots instead of waiting 30 s per call
+client = MongoClient(
+    'mongodb://localhost:27017/',  # Replace with your MongoDB URI if using a cloud-hosted MongoDB
+    serverSelectionTimeoutMS=MONGO_TIMEOUT_MS,
+    connectTimeoutMS=MONGO_TIMEOUT_MS,
+    socketTimeoutMS=MONGO_TIMEOUT_MS * 2,
+)
 db = client['market_data']
 collection = db['option_chain_cache']
 
+# Full snapshots expire after SNAPSHOT_TTL_DAYS if set (an expiry added to an existing collection deletes its older
+# history); per-strike daily buckets (set BUCKET_SAMPLES=0 to disable) expire after BUCKET_TTL_DAYS
+SNAPSHOT_TTL_DAYS = float(os.environ.get('SNAPSHOT_TTL_DAYS', 0))
+BUCKET_TTL_DAYS = float(os.environ.get('BUCKET_TTL_DAYS', 90))
+store = SnapshotStore(
+    collection,
+    bucket_collection=db['option_chain_buckets'] if os.environ.get('BUCKET_SAMPLES', '1') != '0' else None,
+    snapshot_ttl_days=SNAPSHOT_TTL_DAYS or None,
+    bucket_ttl_days=BUCKET_TTL_DAYS or None,
+    # SNAPSHOT_FORMAT=rows keeps writing the pre-columnar layout; both are read either way
+    columnar=os.environ.get('SNAPSHOT_FORMAT', 'columnar') != 'rows',
+    # Snapshots are served as soon as they are built and written to MongoDB in background batches;
+    # WRITE_BEHIND=0 writes them on the refresh thread instead
+    write_behind=os.environ.get('WRITE_BEHIND', '1') != '0',
+    max_pending=int(os.environ.get('WRITE_BEHIND_MAX_PENDING', 500)),
+)
+# Only the worker holding this lease calls the Dhan API; every other worker serves reads
+leader_lock = LeaderLock(db['locks'], name='option_chain_scheduler', ttl=30)
+
+# Latest snapshot per underlying/expiry served from memory; refreshed by update_cache() and other workers' inserts.
+# While this process is the leader, nobody else writes, so its own snapshots are never re-checked against MongoDB.
+snapshot_registry = SnapshotRegistry(collection, authoritative=lambda: leader_lock.is_leader)
+
+# Strikes either side of ATM served by default, and the most a client may ask for with ?window=
+DEFAULT_WINDOW = int(os.environ.get('STRIKE_WINDOW', 5))
+MAX_WINDOW = int(os.environ.get('MAX_STRIKE_WINDOW', 50))
+
+# Push channel for /api/stream, one channel per underlying/expiry/window; fed once per new snapshot, never per connection.
+# Idle streams nudge the cache so followers still notice other workers' inserts.
+# Each open stream holds a gthread worker thread, so streams are capped below GUNICORN_THREADS to keep threads free for
+# other requests; clients over the cap get a 503 and the page falls back to polling.
+MAX_STREAMS = int(os.environ.get('MAX_STREAMS_PER_WORKER', max(int(os.environ.get('GUNICORN_THREADS', 32)) - 8, 1)))
+broadcaster = Broadcaster(on_idle=lambda channel: snapshot_registry.cache(*channel[:2]).get(),
+                          max_subscribers=MAX_STREAMS or None)
+
+
+def broadcast_snapshot(document, payload, previous):
+    key = (document['underlying'], document['expiry'])
+    snapshot_cache = snapshot_registry.cache(*key)
+    for channel in broadcaster.channels():
+        if channel[:2] != key:
+            continue
+        window = channel[2]
+        # Subscribers holding the previous snapshot only need the changed cells
+        patch = None
+        if previous is not None:
+            patch = snapshot_cache.patch_for(document, snapshot_id(previous['timestamp']), window)
+        if patch is not None:
+            broadcaster.publish(sse_message(patch, 'patch'), channel)
+        else:
+            body = snapshot_cache.payload_for(document, window).body if window is not None else payload.body
+            broadcaster.publish(sse_message(body, 'snapshot'), channel)
+
+
+snapshot_registry.add_listener(broadcast_snapshot)
+
+# Rendered index page per underlying/expiry, re-rendered once per snapshot
+page_cache = PageCache()
+
+# Today's per-strike OI series, kept columnar in memory for /api/history
+intraday_history = IntradayHistory()
+snapshot_registry.add_listener(lambda document, payload, previous: intraday_history.append(document))
+
+# Session totals, PCR range, max pain and build-up, updated once per snapshot for /api/analytics
+session_analytics = SessionAnalytics()
+snapshot_registry.add_listener(lambda document, payload, previous: session_analytics.update(document))
+
+# Latest snapshots saved on local disk by the scheduler leader after every update, so a restarted process on this host
+# serves them at once instead of waiting for MongoDB. WARM_START_FILE= disables it. WARM_START_HISTORY=1 also saves
+# today's intraday series; each save then re-encodes the whole day, which grows to tens of MB late in the session.
+WARM_START_FILE = os.environ.get('WARM_START_FILE', '/var/tmp/option_chain_warm_start.bin')
+WARM_START_HISTORY = os.environ.get('WARM_START_HISTORY', '0') == '1'
+warm_start_file = WarmStartFile(
+    WARM_START_FILE,
+    lambda: (snapshot_registry.snapshots(), intraday_history.export() if WARM_START_HISTORY else None),
+) if WARM_START_FILE else None
+
+
+def save_warm_start(document, payload, previous):
+    # Only the leader holds every pair, and one writer per host keeps the file whole
+    if leader_lock.is_leader:
+        warm_start_file.schedule()
+
+
+if warm_start_file:
+    snapshot_registry.add_listener(save_warm_start)
+
 TESTING_MODE = False  # Set to True for testing, False for production
 
 
@@ -27,6 +143,16 @@ access_token = ''  # Replace with your access token
 
 dhan = dhanhq(client_id, access_token)
 
+# Identical in-flight Dhan calls share one request and successful responses are reused for DHAN_CACHE_TTL
+# seconds; only real calls wait for Dhan's per-chain rate limit (3 seconds)
+dhan_client = DhanClient(dhan, ttl=float(os.environ.get('DHAN_CACHE_TTL', 2)), min_interval=3.0)
+
+# Fetches every registered underlying/expiry concurrently; the Dhan client spaces the calls
+fetcher = OptionChainFetcher(dhan_client, INSTRUMENTS, min_interval=0)
+
+# Fills the IV and Greeks Dhan leaves empty; COMPUTE_GREEKS=0 serves Dhan's values as they are
+greeks_engine = GreeksEngine() if os.environ.get('COMPUTE_GREEKS', '1') != '0' else None
+
 # Function to check if market is open
 def is_market_open():
     # Define IST timezone
@@ -38,142 +164,270 @@ def is_market_open():
     # Convert the UTC time to IST
     ist_now = utc_now.replace(tzinfo=pytz.utc).astimezone(ist)
 
-    # Market open and close times in IST
-    market_open_time = datetime.strptime("09:15:00", "%H:%M:%S").time()
-    market_close_time = datetime.strptime("15:30:00", "%H:%M:%S").time()
+    # Weekends and NSE holidays are closed; sessions run 09:15-15:30 IST
+    return market_calendar.phase(ist_now) == OPEN
+
+# Retries of failed refreshes run as deferred scheduler jobs instead of sleeping in the refresh job
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 5  # seconds for exponential backoff
+REFRESH_INTERVAL = 60  # seconds between refreshes in TESTING_MODE; otherwise set by the market calendar
+# A failed post-close publish is retried the same way, with longer backoff as S3 outages outlast API hiccups
+PUBLISH_MAX_RETRIES = 5
+PUBLISH_RETRY_BASE_DELAY = 30
+PUBLISH_RETRY_MAX_DELAY = 300
+
+# Trading calendar driving the refresh cadence and the publish-on-close
+market_calendar = MarketCalendar()
+last_close_publish = None  # IST date of the last static site publish
+refresh_running = threading.Event()  # set while refresh_job() runs (its next run is not scheduled yet)
+
+
+# Function to refresh one underlying/expiry in MongoDB; failures are retried by a deferred job
+def refresh_option_chain(instrument, expiry_date, attempt=0):
+    try:
+        # Fetch data from Dhan API
+        option_chain_data = fetcher.fetch(instrument, expiry_date)
+
+        # Check if data was retrieved successfully
+        if option_chain_data.get('status') == 'success':
+            # Process and structure data
+            nested_data = option_chain_data['data']['data']
+            last_price = nested_data.get('last_price')
+
+            # Transform the whole chain column-wise; windows around ATM are sliced from it
+            fill = None
+            if greeks_engine is not None:
+                years = years_to_expiry(expiry_date)
+                fill = lambda frame: greeks_engine.fill(frame, (instrument['name'], expiry_date), last_price, years)
+            with TRANSFORM_SECONDS.time(underlying=instrument['name']):
+                chain = build_chain(nested_data['oc'], fill)
+            # Strike spacing as listed, falling back to the registry for chains too short to tell
+            strike_interval = detect_interval(chain['strikes']) or instrument['strike_interval']
+            atm_strike = round(last_price / strike_interval) * strike_interval  # Calculate ATM strike price
+
+            # Insert data into MongoDB with timestamp; `data` holds the default ±DEFAULT_WINDOW rows
+            document = with_window({
+                'underlying': instrument['name'],
+                'expiry': expiry_date,
+                'timestamp': datetime.utcnow(),
+                'chain': chain,
+                'window': DEFAULT_WINDOW,
+                'strike_interval': strike_interval,
+                'atm_strike': atm_strike
+            }, DEFAULT_WINDOW)
+            start = time.perf_counter()
+            inserted = store.insert(document)
+            MONGO_INSERT_SECONDS.observe(time.perf_counter() - start, underlying=instrument['name'],
+                                         result='inserted' if inserted else 'unchanged')
+            if inserted:
+                snapshot_registry.publish(document, local=True)
+                logging.info(f"Cache updated in MongoDB for {instrument['name']} {expiry_date} at {datetime.utcnow()}")
+            else:
+                # Nothing moved; keep serving the current snapshot and only record the check
+                snapshot_registry.cache(instrument['name'], expiry_date).touch(document['timestamp'])
+                logging.info(f"Snapshot unchanged for {instrument['name']} {expiry_date}; recorded check at {document['timestamp']}")
+
+            return  # Exit the function on successful fetch
+
+        else:
+            REFRESH_FAILURES.inc(underlying=instrument['name'], reason='api_error')
+            logging.error("Failed to retrieve data from Dhan API for %s %s. Full Response: %s",
+                          instrument['name'], expiry_date, option_chain_data)
+
+    except CircuitOpenError as e:
+        # The breaker lets a trial call through once its timeout passes; don't queue retries meanwhile
+        REFRESH_FAILURES.inc(underlying=instrument['name'], reason='circuit_open')
+        logging.warning("%s; skipping refresh", e)
+        return
+
+    except Exception as e:
+        REFRESH_FAILURES.inc(underlying=instrument['name'], reason='exception')
+        logging.error("Exception occurred refreshing %s %s, attempt %d: %s", instrument['name'], expiry_date, attempt + 1, e)
 
-    # Get the current time in IST (ignoring the date)
-    current_time = ist_now.time()
+    schedule_retry(instrument, expiry_date, attempt + 1)
 
-    # Check if the market is open
-    return market_open_time <= current_time <= market_close_time
 
-# Function to update cache in MongoDB with retry mechanism
+def schedule_retry(instrument, expiry_date, attempt):
+    if attempt >= MAX_RETRIES:
+        return
+    delay = retry_delay(attempt - 1, RETRY_BASE_DELAY)
+    if delay >= (REFRESH_INTERVAL if TESTING_MODE else market_calendar.refresh_interval() or REFRESH_INTERVAL):
+        # The next scheduled refresh comes sooner than this retry would
+        return
+    logging.info("Retrying %s %s in %.1f seconds...", instrument['name'], expiry_date, delay)
+    fetcher.stats.record_retry((instrument['name'], expiry_date))
+    REFRESH_RETRIES.inc(underlying=instrument['name'])
+    scheduler.add_job(
+        refresh_option_chain,
+        'date',
+        run_date=datetime.now(pytz.utc) + timedelta(seconds=delay),
+        args=[instrument, expiry_date, attempt],
+        id=f"retry-{instrument['name']}-{expiry_date}",
+        replace_existing=True,
+        misfire_grace_time=10,
+    )
+
+
+# Function to update cache in MongoDB for every registered underlying and expiry
 def update_cache():
+    # Followers pick up the leader's snapshots through the snapshot registry
+    if not leader_lock.is_leader:
+        return
+
     # Check if market is open
     if not TESTING_MODE and not is_market_open():
         logging.info("Market is closed. Serving data from MongoDB.")
         return
 
-    max_retries = 3
-    base_delay = 5  # seconds for exponential backoff
+    fetcher.run(refresh_option_chain)
 
-    for attempt in range(max_retries):
-        try:
-            # Define parameters for the API call
-            under_security_id = 26009  # Replace with actual security ID for Bank Nifty
-            under_exchange_segment = "NSE_FNO"  # Segment for Bank Nifty options NSE_FNO
-            expiry_date = "2025-01-30"  # Example expiry date
-
-            # Fetch data from Dhan API
-            option_chain_data = dhan.option_chain(
-                under_security_id=under_security_id,
-                under_exchange_segment=under_exchange_segment,
-                expiry=expiry_date
-            )
 
-            # Check if data was retrieved successfully
-            if option_chain_data.get('status') == 'success':
-                # Process and structure data
-                nested_data = option_chain_data['data']['data']
-                last_price = nested_data.get('last_price')
-                atm_strike = round(last_price / 100) * 100  # Calculate ATM strike price
-
-                # Extract ±5 strikes from ATM
-                option_chain = nested_data['oc']
-                strikes_to_display = [float(atm_strike + i * 100) for i in range(-5, 6)]
-
-                rows = []
-                for strike_price_str, options in option_chain.items():
-                    strike_price = float(strike_price_str)
-                    if strike_price in strikes_to_display:
-                        # CE values
-                        ce_open_interest = options['ce'].get('oi', 0) / 100000
-                        ce_previous_open_interest = options['ce'].get('previous_oi', 0) / 100000
-                        ce_volume = options['ce'].get('volume', 0)
-                        ce_ask = options['ce'].get('top_ask_price', 0)
-                        ce_bid = options['ce'].get('top_bid_price', 0)
-                        ce_spread = ce_ask - ce_bid
-                        ce_mid = (ce_ask + ce_bid) / 2 if (ce_ask + ce_bid) != 0 else 1
-                        ce_sp = (ce_spread / ce_mid) * 100 if ce_mid != 0 else 0
-
-                        # PE values
-                        pe_open_interest = options['pe'].get('oi', 0) / 100000
-                        pe_previous_open_interest = options['pe'].get('previous_oi', 0) / 100000
-                        pe_volume = options['pe'].get('volume', 0)
-                        pe_ask = options['pe'].get('top_ask_price', 0)
-                        pe_bid = options['pe'].get('top_bid_price', 0)
-                        pe_spread = pe_ask - pe_bid
-                        pe_mid = (pe_ask + pe_bid) / 2 if (pe_ask + pe_bid) != 0 else 1
-                        pe_sp = (pe_spread / pe_mid) * 100 if pe_mid != 0 else 0
-
-                        # Construct row data
-                        row = {
-                            'STP': strike_price,
-                            'CLTP': options['ce'].get('last_price', 0),
-                            'CEOI': ce_open_interest,
-                            'CE-CH-OI': ce_open_interest - ce_previous_open_interest,
-                            'CE-IV': options['ce'].get('implied_volatility', 0),
-                            'CE-Delta': options['ce']['greeks'].get('delta', 0),
-                            'CE-Gamma': options['ce'].get('gamma', 0),
-                            'CE-Sp': ce_sp,
-                            'PLTP': options['pe'].get('last_price', 0),
-                            'PEOI': pe_open_interest,
-                            'PE-CH-OI': pe_open_interest - pe_previous_open_interest,
-                            'PE-IV': options['pe'].get('implied_volatility', 0),
-                            'PE-Delta': options['pe']['greeks'].get('delta', 0),
-                            'PE-Gamma': options['pe'].get('gamma', 0),
-                            'PE-Sp': pe_sp,
-                            'PEOI - CEOI': pe_open_interest - ce_open_interest,
-                            'Trending OI': (pe_open_interest - pe_previous_open_interest) - (ce_open_interest - ce_previous_open_interest),
-                            'CE Volume': ce_volume,
-                            'PE Volume': pe_volume,
-                            'Total Volume Difference': pe_volume - ce_volume
-                        }
-                        rows.append(row)
-
-                # Insert data into MongoDB with timestamp
-                document = {
-                    'timestamp': datetime.utcnow(),
-                    'data': rows,
-                    'atm_strike': atm_strike
-                }
-                collection.insert_one(document)
-                logging.info(f"Cache updated in MongoDB at {datetime.utcnow()}")
-
-                return  # Exit the function on successful fetch
+def is_expiry_day():
+    today = market_calendar.now().date().isoformat()
+    return any(expiry == today for _, expiry in fetcher.jobs())
 
-            else:
-                logging.error("Failed to retrieve data from Dhan API. Full Response: %s", option_chain_data)
 
-        except Exception as e:
-            logging.error("Exception occurred in update_cache attempt %d: %s", attempt + 1, e)
+def publish_on_close(attempt=0):
+    # Upload the default underlying's closing snapshot to S3 once per session; the DNS flip stays with switchover.py
+    global last_close_publish
+    today = market_calendar.now().date()
+    if not leader_lock.is_leader or last_close_publish == today:
+        return
+    if attempt == 0 and scheduler.get_job('publish-close') is not None:
+        return  # A retry of a failed publish is already pending
+    try:
+        # upload reads from MongoDB; let queued closing snapshots land first
+        if not store.flush(timeout=30):
+            logging.warning("Snapshot writes still pending; publishing what MongoDB has")
+        data = upload.fetch_latest_data()
+        if not data:
+            logging.warning("No data available in MongoDB; skipping the post-close publish")
+            return
+        uploaded, skipped = upload.publish(data)
+    except Exception as e:
+        logging.error("Post-close publish failed, attempt %d: %s", attempt + 1, e)
+        schedule_publish_retry(attempt + 1)
+        return
+    last_close_publish = today
+    logging.info("Published closing snapshot to S3: %d uploaded, %d unchanged", len(uploaded), len(skipped))
+
 
-        # Exponential backoff
-        delay = base_delay * (2 ** attempt)
-        if attempt < max_retries - 1:
-            logging.info("Retrying in %d seconds...", delay)
-            time.sleep(delay)
+def schedule_publish_retry(attempt):
+    if attempt >= PUBLISH_MAX_RETRIES:
+        logging.error("Giving up on the post-close publish after %d attempts; run switchover.py close to publish", attempt)
+        return
+    delay = retry_delay(attempt - 1, PUBLISH_RETRY_BASE_DELAY, PUBLISH_RETRY_MAX_DELAY)
+    logging.info("Retrying the post-close publish in %.1f seconds...", delay)
+    scheduler.add_job(
+        publish_on_close,
+        'date',
+        run_date=datetime.now(pytz.utc) + timedelta(seconds=delay),
+        args=[attempt],
+        id='publish-close',
+        replace_existing=True,
+        misfire_grace_time=60,
+    )
+
+
+def refresh_job():
+    """Run the work for the current market phase, then schedule the next run.
+
+    The job reschedules itself instead of running on a fixed interval, so the
+    cadence follows the market calendar: faster around the open, the close and
+    expiry afternoons, slower at midday, and idle outside trading sessions.
+    """
+    expiry_day = False
+    refresh_running.set()
+    try:
+        phase = market_calendar.phase()
+        if TESTING_MODE or phase == OPEN:
+            update_cache()
+        elif phase == PRE_OPEN and leader_lock.is_leader:
+            fetcher.jobs()  # Resolve today's expiries before the open
+        elif phase == POST_CLOSE:
+            publish_on_close()
+        # Only the leader knows (and may look up) today's expiries
+        expiry_day = leader_lock.is_leader and is_expiry_day()
+    except Exception as e:
+        logging.error("Refresh job failed: %s", e)
+    finally:
+        delay = REFRESH_INTERVAL if TESTING_MODE else market_calendar.next_run_delay(expiry_today=expiry_day)
+        schedule_refresh(delay)
+        refresh_running.clear()
+
+
+def schedule_refresh(delay):
+    # No misfire grace limit: a late run (paused VM, busy executor) still runs instead of silently ending the chain
+    scheduler.add_job(refresh_job, 'date', run_date=datetime.now(pytz.utc) + timedelta(seconds=delay),
+                      id='refresh', replace_existing=True, misfire_grace_time=None, coalesce=True)
+
+
+def refresh_watchdog():
+    # Re-arm the self-rescheduling refresh job if it ever went missing
+    if not refresh_running.is_set() and scheduler.get_job('refresh') is None:
+        logging.warning("Refresh job was not scheduled; re-arming it")
+        schedule_refresh(1)
+
+
+# Resolve ?underlying=&expiry= to a snapshot cache; defaults to the first underlying's nearest expiry
+def requested_snapshot_cache():
+    instrument = get_instrument(request.args.get('underlying', DEFAULT_UNDERLYING))
+    if instrument is None:
+        return None, None
+    expiry = request.args.get('expiry')
+    if expiry is None:
+        today = datetime.now(pytz.timezone('Asia/Kolkata')).date().isoformat()
+        expiry = snapshot_registry.default_expiry(instrument['name'], today)
+        if expiry is None:
+            return instrument, None
+    try:
+        expiry = datetime.strptime(expiry, '%Y-%m-%d').date().isoformat()
+    except ValueError:
+        return instrument, None
+    return instrument, snapshot_registry.find(instrument['name'], expiry)
+
+
+# Resolve ?window=N (strikes either side of ATM); None means the default window
+def requested_window():
+    window = request.args.get('window', type=int)
+    if window is None or window == DEFAULT_WINDOW:
+        return None
+    return min(max(window, 0), MAX_WINDOW)
 
 
 # Route to serve the main page
 @app.route('/')
 def index():
-    latest_data = collection.find_one(sort=[('timestamp', -1)])  # Retrieve the latest document from MongoDB
+    instrument, snapshot_cache = requested_snapshot_cache()
+    if snapshot_cache is None:
+        return "Unknown underlying or expiry", 404
+    window = requested_window()
+    latest_data = snapshot_cache.get()  # Latest document, served from the in-process cache
     if latest_data:
         # Generate a unique nonce for CSP
         nonce = os.urandom(16).hex()
-        
-        # Create response with CSP header containing the nonce
-        response = make_response(
-            render_template(
+        payload = snapshot_cache.payload_for(latest_data, window)
+        query = {'underlying': latest_data['underlying'], 'expiry': latest_data['expiry']}
+        if window is not None:
+            query['window'] = window
+
+        def render(nonce_placeholder):
+            return render_template(
                 'index.html', 
-                data=latest_data['data'], 
+                data=payload.document['data'], 
                 atm_strike=latest_data['atm_strike'], 
                 timestamp=latest_data['timestamp'], 
-                nonce=nonce  # Pass the nonce to the template
+                underlying=latest_data['underlying'],
+                expiry=latest_data['expiry'],
+                instrument_query=query,
+                # Embedded so the table renders without waiting for /api/data
+                initial_snapshot=payload.representation('columnar')[0].decode('utf-8').replace('</', '<\\/'),
+                nonce=nonce_placeholder  # Substituted with the request's nonce by the page cache
             )
-        )
+
+        # Create response with CSP header containing the nonce; the page is only rendered once per snapshot
+        key = (latest_data['underlying'], latest_data['expiry'], window)
+        response = make_response(page_cache.render(key, payload.snapshot_id, render, nonce))
         
         # Set the CSP header to allow inline scripts and styles with the generated nonce
         response.headers['Content-Security-Policy'] = (
@@ -191,33 +445,148 @@ def index():
 # Route to provide data from MongoDB as JSON
 @app.route('/api/data')
 def get_data():
-    latest_data = collection.find_one(sort=[('timestamp', -1)])
-    if latest_data:
-        response = make_response(jsonify({
-            'data': latest_data['data'],
-            'atm_strike': latest_data['atm_strike'],
-            'timestamp': latest_data['timestamp']
-        }))
-        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, proxy-revalidate, max-age=0'
+    instrument, snapshot_cache = requested_snapshot_cache()
+    if snapshot_cache is None:
+        return jsonify({'error': 'Unknown underlying or expiry'}), 404
+    # ?window=N serves N strikes either side of ATM, sliced in memory from the full chain
+    window = requested_window()
+    payload = snapshot_cache.get_payload(window)
+    # ?format=columnar (or msgpack, when installed) serves one array per field instead of row dicts
+    fmt = request.args.get('format', 'json')
+    if fmt not in FORMATS:
+        return jsonify({'error': f"Unsupported format; use one of: {', '.join(FORMATS)}"}), 400
+    if payload:
+        # ?since=<snapshot_id> asks for a patch against a snapshot the client already holds
+        since = request.args.get('since', type=int)
+        patch = None
+        if since is not None and since != payload.snapshot_id:
+            patch = snapshot_cache.get_patch(since, window)
+
+        # Clients may keep the body but must revalidate it on every poll
+        if since == payload.snapshot_id or payload.matches(request.if_none_match, fmt):
+            response = make_response('', 304)
+            response.headers['ETag'] = payload.format_etag(fmt)
+        elif patch is not None:
+            response = make_response(patch)
+            response.headers['Content-Type'] = 'application/json'
+        else:
+            encoding, body, etag = payload.negotiate(request.accept_encodings, fmt)
+            response = make_response(body)
+            response.headers['Content-Type'] = FORMATS[fmt]
+            response.headers['ETag'] = etag
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = 'no-cache, must-revalidate, max-age=0'
         return response
     else:
         return jsonify({'error': 'No data available'}), 500
-# Initialize the scheduler to refresh cache every 1 minute
+# Route to push each new snapshot as Server-Sent Events
+@app.route('/api/stream')
+def stream_data():
+    instrument, snapshot_cache = requested_snapshot_cache()
+    if snapshot_cache is None:
+        return jsonify({'error': 'Unknown underlying or expiry'}), 404
+    window = requested_window()
+    payload = snapshot_cache.get_payload(window)
+    initial = sse_message(payload.body, 'snapshot') if payload else None
+    channel = (snapshot_cache.query['underlying'], snapshot_cache.query['expiry'], window)
+    subscriber = broadcaster.subscribe(channel)
+    if subscriber is None:
+        STREAMS_REJECTED.inc()
+        response = jsonify({'error': 'Too many open streams; poll /api/data instead'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+    response = Response(broadcaster.stream(initial, channel, subscriber), mimetype='text/event-stream')
+    # A response closed before its first chunk never runs the generator's cleanup
+    response.call_on_close(lambda: broadcaster.unsubscribe(subscriber, channel))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Disable proxy buffering (nginx)
+    return response
+
+# Scheduler for the refresh job; started per process by start_background_jobs(), not at import
 scheduler = BackgroundScheduler()
-scheduler.add_job(update_cache, 'interval', minutes=1)
-scheduler.start()
 
-# Ensure scheduler is properly shut down on exit
-import atexit
-atexit.register(lambda: scheduler.shutdown())
+
+def restore_warm_start():
+    """Serve the snapshots saved by the previous process until MongoDB catches up."""
+    start = time.perf_counter()
+    state = warm_start_file.load()
+    if state is None:
+        return
+    if state.get('history'):
+        intraday_history.restore(state['history'], state['saved_at'])
+    for document in state['snapshots']:
+        snapshot_registry.restore(document)
+    logging.info("Restored %d snapshots saved at %s from %s in %.1f ms", len(state['snapshots']), state['saved_at'],
+                 warm_start_file.path, (time.perf_counter() - start) * 1000)
+
+
+def warm_up_mongo():
+    """Create the indexes and load the restored caches from MongoDB, retrying until it is reachable."""
+    indexed = False
+    attempt = 0
+    while True:
+        if not indexed:
+            try:
+                store.ensure_indexes()
+                indexed = True
+            except ConnectionFailure as e:
+                logging.warning("MongoDB not reachable yet: %s", e)
+            except Exception as e:
+                logging.error("Failed to create MongoDB indexes: %s", e)
+                indexed = True
+        if indexed and snapshot_registry.load():
+            return
+        time.sleep(retry_delay(attempt, RETRY_BASE_DELAY))
+        attempt += 1
+
+
+def start_background_jobs():
+    """Start leader election, the refresh job and snapshot following in this process.
+
+    Called once per serving process (see wsgi.py). Every process runs the
+    scheduler, but update_cache() only does work in the current leader.
+    """
+    if warm_start_file:
+        restore_warm_start()
+    # MongoDB may still be starting (or down); serving does not wait for it
+    threading.Thread(target=warm_up_mongo, name='mongo-warmup', daemon=True).start()
+
+    now = datetime.now(pytz.utc)
+    # Renew well inside the lease so a healthy leader never lapses
+    scheduler.add_job(leader_lock.acquire_or_renew, 'interval', seconds=leader_lock.ttl / 3,
+                      next_run_time=now, max_instances=1, coalesce=True)
+    # A single self-rescheduling job, so a slow run delays the next one instead of overlapping it
+    schedule_refresh(1)
+    scheduler.add_job(refresh_watchdog, 'interval', minutes=5, max_instances=1, coalesce=True)
+    scheduler.start()
+
+    # Pick up snapshots inserted by other workers without polling MongoDB
+    snapshot_registry.watch()
+
+    # Ensure scheduler is properly shut down on exit; handlers run in reverse, so queued writes are flushed last
+    atexit.register(store.close)
+    if warm_start_file:
+        atexit.register(warm_start_file.close)
+    atexit.register(leader_lock.release)
+    atexit.register(lambda: scheduler.shutdown())
+    atexit.register(fetcher.shutdown)
+    atexit.register(dhan_client.close)
+
 
 @app.route('/api/initial', methods=['GET'])
 def get_initial_data():
     """Provide dynamic ATM and STRIKE_INTERVAL values."""
-    latest_data = collection.find_one(sort=[('timestamp', -1)])  # Fetch the latest data from MongoDB
+    instrument, snapshot_cache = requested_snapshot_cache()
+    if snapshot_cache is None:
+        return jsonify({'error': 'Unknown underlying or expiry'}), 404
+    latest_data = snapshot_cache.get()  # Fetch the latest data from the snapshot cache
     if latest_data:
         atm_strike = latest_data['atm_strike']  # Fetch ATM value
-        strike_interval = 100  # Default interval, adjust if needed dynamically
+        # Interval detected from the listed strikes; older snapshots fall back to the instrument registry
+        strike_interval = latest_data.get('strike_interval', instrument['strike_interval'])
         return jsonify({
             "atm": atm_strike,
             "strike_interval": strike_interval
@@ -226,6 +595,154 @@ def get_initial_data():
         return jsonify({"error": "No data available"}), 500
 
 
+# Parse a ?from=/?to= value given as UTC epoch milliseconds or an ISO 8601 timestamp
+def parse_time_arg(value, default):
+    if not value:
+        return default
+    if value.isdigit():
+        return datetime.utcfromtimestamp(int(value) / 1000)
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(pytz.utc).replace(tzinfo=None)
+    return parsed
+
+
+@app.route('/api/history', methods=['GET'])
+def get_history():
+    """Downsampled intraday OI, change-in-OI, LTP and PCR series per strike, as columnar arrays."""
+    instrument, snapshot_cache = requested_snapshot_cache()
+    if snapshot_cache is None:
+        return jsonify({'error': 'Unknown underlying or expiry'}), 404
+    underlying, expiry = snapshot_cache.query['underlying'], snapshot_cache.query['expiry']
+
+    resolution = RESOLUTIONS.get(request.args.get('resolution', '1m'))
+    if resolution is None:
+        return jsonify({'error': f"resolution must be one of {', '.join(RESOLUTIONS)}"}), 400
+    try:
+        strikes = {float(request.args['strike'])} if request.args.get('strike') else None
+        now = datetime.utcnow()
+        # Default to today's session (IST midnight onwards)
+        start = parse_time_arg(request.args.get('from'), ist_day_start(now))
+        end = parse_time_arg(request.args.get('to'), now)
+    except ValueError:
+        return jsonify({'error': 'Invalid strike, from or to'}), 400
+
+    if intraday_history.covers(underlying, expiry, to_millis(start), to_millis(end), strikes):
+        series = intraday_history.query(underlying, expiry, strikes, to_millis(start), to_millis(end), resolution)
+    elif store.bucket_collection is not None:
+        try:
+            series = query_buckets(store.bucket_collection, underlying, expiry, strikes, start, end, resolution)
+        except PyMongoError as e:
+            logging.error("Failed to read history for %s %s from MongoDB: %s", underlying, expiry, e)
+            return jsonify({'error': 'History temporarily unavailable'}), 503
+    else:
+        series = {}
+
+    return jsonify({
+        'underlying': underlying,
+        'expiry': expiry,
+        'resolution': request.args.get('resolution', '1m'),
+        'from': to_millis(start),
+        'to': to_millis(end),
+        'strikes': {str(strike): columns for strike, columns in series.items()},
+    })
+
+
+@app.route('/api/analytics', methods=['GET'])
+def get_analytics():
+    """Running session aggregates for one underlying/expiry."""
+    instrument, snapshot_cache = requested_snapshot_cache()
+    if snapshot_cache is None:
+        return jsonify({'error': 'Unknown underlying or expiry'}), 404
+    snapshot_cache.get()  # Make sure followers have seen the latest snapshot
+    analytics = session_analytics.get(snapshot_cache.query['underlying'], snapshot_cache.query['expiry'])
+    if analytics is None:
+        return jsonify({'error': 'No data available'}), 500
+    return jsonify(analytics)
+
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """Expose in-process cache counters."""
+    return jsonify({
+        'snapshot_cache': snapshot_registry.stats(),
+        'stream_subscribers': broadcaster.subscriber_count(),
+        'fetch': fetcher.export_stats(),
+        'page_cache': page_cache.stats(),
+        'greeks': greeks_engine.stats() if greeks_engine is not None else None,
+        'write_behind': store.writer.stats() if store.writer is not None else None,
+        'warm_start': warm_start_file.stats() if warm_start_file else None,
+    })
+
+
+def snapshot_metric(field):
+    # Per underlying/expiry values from the snapshot registry's stats, keyed by label values
+    def collect():
+        return {
+            tuple(key.split(':', 1)): value
+            for key, value in ((key, field(stats)) for key, stats in snapshot_registry.stats()['snapshots'].items())
+            if value is not None
+        }
+    return collect
+
+
+def seconds_since(timestamp):
+    return (datetime.utcnow() - timestamp).total_seconds() if timestamp is not None else None
+
+
+REGISTRY.register(CallbackMetric(
+    'option_chain_snapshot_age_seconds', 'Seconds since the latest snapshot changed.', 'gauge',
+    snapshot_metric(lambda stats: seconds_since(stats['timestamp'])), ('underlying', 'expiry')))
+REGISTRY.register(CallbackMetric(
+    'option_chain_snapshot_staleness_seconds', 'Seconds since the data was last confirmed current (changed or checked unchanged).',
+    'gauge', snapshot_metric(lambda stats: seconds_since(max(filter(None, [stats['timestamp'], stats['checked_at']]), default=None))),
+    ('underlying', 'expiry')))
+REGISTRY.register(CallbackMetric(
+    'option_chain_snapshot_cache_hits_total', 'Snapshot cache reads served without MongoDB.', 'counter',
+    snapshot_metric(lambda stats: stats['hits']), ('underlying', 'expiry')))
+REGISTRY.register(CallbackMetric(
+    'option_chain_snapshot_cache_misses_total', 'Snapshot cache reads that went to MongoDB.', 'counter',
+    snapshot_metric(lambda stats: stats['misses']), ('underlying', 'expiry')))
+REGISTRY.register(CallbackMetric(
+    'page_cache_hits_total', 'Index page renders served from the page cache.', 'counter',
+    lambda: {(): page_cache.stats()['warm_hits']}))
+REGISTRY.register(CallbackMetric(
+    'stream_subscribers', 'Connected /api/stream clients.', 'gauge',
+    lambda: {(): broadcaster.subscriber_count()}))
+REGISTRY.register(CallbackMetric(
+    'option_chain_writes_pending', 'Snapshot writes queued for MongoDB.', 'gauge',
+    lambda: {(): store.writer.pending()} if store.writer is not None else {}))
+REGISTRY.register(CallbackMetric(
+    'scheduler_leader', '1 if this process runs the refresh job.', 'gauge',
+    lambda: {(): int(leader_lock.is_leader)}))
+
+request_profiler = RequestProfiler()
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus text exposition of this process's metrics."""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.profiler = request_profiler.start()
+
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(elapsed, route=route, method=request.method, status=response.status_code)
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            request_profiler.finish(profiler, route, elapsed)
+    return response
+
 
 @app.after_request
 def add_security_headers(response):
@@ -247,8 +764,9 @@ def add_security_headers(response):
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
-    update_cache()  # Initial cache update
-    app.run(port = 8000, debug=True)
+    start_background_jobs()  # Elects this process leader and runs the initial cache update
+    # Development server only; use wsgi.py under gunicorn in production. The reloader would start a second scheduler.
+    app.run(port = 8000, debug=os.environ.get('FLASK_DEBUG') == '1', use_reloader=False, threaded=True)
 
 
 
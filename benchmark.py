@@ -0,0 +1,303 @@
+import argparse
+import contextlib
+import glob
+import io
+import json
+import logging
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Benchmark harness for the refresh and serving paths.
+#
+# Replays synthetic (or recorded) Dhan option_chain responses through the
+# transform, the storage path and the Flask routes, against mongomock or a
+# scratch mongod, and reports transform latency, per-tick refresh cost,
+# IV/Greeks fill cost, generate_html() cost and per-route p50/p99 latency and
+# requests/sec.
+#
+#   python benchmark.py                                  # mongomock, default sizes
+#   python benchmark.py --strikes 11,101,501 --underlyings 20 --concurrency 16
+#   python benchmark.py --replay recorded/ --json results.json
+#   python benchmark.py --mongo-uri mongodb://localhost:27018/   # scratch mongod only
+#
+# Recorded responses are JSON files holding the full option_chain response
+# ({"status": "success", "data": {"data": {"last_price", "oc"}}}).
+# mongomock is a development dependency: pip install mongomock.
+
+SPOT = 24000.0
+INTERVAL = 50
+
+
+def synthetic_leg(rng, spot, strike, call):
+    moneyness = (strike - spot) / spot
+    intrinsic = max(spot - strike, 0) if call else max(strike - spot, 0)
+    time_value = spot * 0.01 * math.exp(-abs(moneyness) * 25) * rng.uniform(0.8, 1.2)
+    delta = 1 / (1 + math.exp(moneyness * 60))
+    return {
+        'last_price': round(intrinsic + time_value, 2),
+        'oi': int(5e6 * math.exp(-abs(moneyness) * 30) * rng.uniform(0.3, 1.7)),
+        'previous_oi': int(5e6 * math.exp(-abs(moneyness) * 30) * rng.uniform(0.3, 1.7)),
+        'volume': int(2e7 * math.exp(-abs(moneyness) * 20) * rng.uniform(0.1, 1.0)),
+        'top_bid_price': round(max(intrinsic + time_value - 0.5, 0.05), 2),
+        'top_ask_price': round(intrinsic + time_value + 0.5, 2),
+        'implied_volatility': round(12 + abs(moneyness) * 80 + rng.uniform(-1, 1), 2),
+        'greeks': {
+            'delta': round(delta if call else delta - 1, 4),
+            'theta': round(-time_value / 7, 4),
+            'gamma': round(0.002 * math.exp(-abs(moneyness) * 40), 6),
+            'vega': round(time_value / 10, 4),
+        },
+    }
+
+
+def synthetic_response(strikes, spot=SPOT, interval=INTERVAL, seed=0):
+    """An option_chain response with `strikes` strikes centred on `spot`."""
+    rng = random.Random(seed)
+    spot = spot * (1 + rng.uniform(-0.002, 0.002))
+    lowest = round(spot / interval) * interval - (strikes // 2) * interval
+    chain = {}
+    for i in range(strikes):
+        strike = lowest + i * interval
+        chain[f'{strike:.6f}'] = {
+            'ce': synthetic_leg(rng, spot, strike, call=True),
+            'pe': synthetic_leg(rng, spot, strike, call=False),
+        }
+    return {'status': 'success', 'data': {'data': {'last_price': round(spot, 2), 'oc': chain}}}
+
+
+def load_recorded(path):
+    paths = sorted(glob.glob(os.path.join(path, '*.json'))) if os.path.isdir(path) else [path]
+    responses = []
+    for name in paths:
+        with open(name) as f:
+            responses.append(json.load(f))
+    return responses
+
+
+def summarize(samples):
+    samples = np.asarray(samples, dtype=float) * 1000
+    return {
+        'count': int(samples.size),
+        'p50_ms': round(float(np.percentile(samples, 50)), 3),
+        'p99_ms': round(float(np.percentile(samples, 99)), 3),
+        'max_ms': round(float(samples.max()), 3),
+    }
+
+
+def bench_transform(responses_by_size, repeat):
+    from columnar import build_chain
+
+    results = {}
+    for size, responses in responses_by_size.items():
+        timings = []
+        for i in range(repeat):
+            nested = responses[i % len(responses)]['data']['data']
+            start = time.perf_counter()
+            build_chain(nested['oc'])
+            timings.append(time.perf_counter() - start)
+        results[size] = summarize(timings)
+    return results
+
+
+def bench_greeks(responses_by_size, repeat):
+    from greeks import GreeksEngine
+    from transform import normalize_chain
+
+    # Worst case: Dhan sent no IV or Greeks at all, and no leg can reuse the previous tick's IV
+    results = {}
+    for size, responses in responses_by_size.items():
+        frames = [(normalize_chain(r['data']['data']['oc']), r['data']['data']['last_price']) for r in responses]
+        for frame, _ in frames:
+            for column in ('ce_iv', 'pe_iv', 'ce_delta', 'pe_delta', 'ce_gamma', 'pe_gamma', 'ce_theta', 'pe_theta',
+                           'ce_vega', 'pe_vega'):
+                frame[column] = 0.0
+        timings = []
+        for i in range(repeat):
+            frame, spot = frames[i % len(frames)]
+            start = time.perf_counter()
+            GreeksEngine().fill(frame.copy(), 'bench', spot, 7 / 365)
+            timings.append(time.perf_counter() - start)
+        results[size] = summarize(timings)
+    return results
+
+
+def use_mongo(uri):
+    """Point every MongoClient the app creates at mongomock or at a scratch mongod, before app is imported."""
+    import pymongo
+    if uri is None:
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("mongomock is not installed; pip install mongomock or pass --mongo-uri")
+        pymongo.MongoClient = mongomock.MongoClient
+        return
+    real_client = pymongo.MongoClient
+
+    def scratch_client(*args, **kwargs):
+        return real_client(uri, **kwargs)
+    pymongo.MongoClient = scratch_client
+
+
+def load_app(underlyings):
+    # Synthetic underlyings with fixed expiries, so no expiry_list calls are made
+    expiry = (datetime.utcnow() + timedelta(days=7)).strftime('%Y-%m-%d')
+    instruments = [
+        {'name': f'BENCH{i}', 'security_id': 900000 + i, 'segment': 'IDX_I',
+         'strike_interval': INTERVAL, 'expiries': [expiry]}
+        for i in range(underlyings)
+    ]
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        json.dump(instruments, f)
+    os.environ['INSTRUMENTS_FILE'] = f.name
+    os.environ['WARM_START_FILE'] = ''  # never overwrite a real deployment's warm start file
+
+    import app
+    app.TESTING_MODE = True
+    app.fetcher.limiter.min_interval = 0
+    app.dhan_client.client.limiter.min_interval = 0
+    app.dhan_client.client.ttl = 0  # every tick must reach the (stubbed) API
+    app.leader_lock.acquire_or_renew()
+    return app, instruments, expiry
+
+
+def bench_refresh(app, ticks, responses):
+    # Each tick serves a different response, so the content hash never short-circuits the write
+    state = {'tick': 0}
+
+    def option_chain(under_security_id, under_exchange_segment, expiry):
+        return responses[(state['tick'] + under_security_id) % len(responses)]
+    app.dhan.option_chain = option_chain
+
+    timings = []
+    for tick in range(ticks):
+        state['tick'] = tick
+        start = time.perf_counter()
+        app.update_cache()
+        timings.append(time.perf_counter() - start)
+    return summarize(timings)
+
+
+def bench_generate_html(app, repeat):
+    import upload
+    from columnar import expand
+
+    document = expand(app.collection.find_one(sort=[('timestamp', -1)]))
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):  # generate_html() prints the ATM strike
+            upload.generate_html(document)
+        timings.append(time.perf_counter() - start)
+    return summarize(timings)
+
+
+def bench_routes(app, instruments, expiry, requests, concurrency):
+    underlying = instruments[0]['name']
+    query = f'underlying={underlying}&expiry={expiry}'
+    # Patch from the previous tick's snapshot, as a polling client one tick behind would ask
+    previous = list(app.collection.find({'underlying': underlying, 'expiry': expiry},
+                                        sort=[('timestamp', -1)], limit=2))[-1]
+    since = app.snapshot_id(previous['timestamp'])
+    routes = {
+        'index': f'/?{query}',
+        'data': f'/api/data?{query}',
+        'data_gzip': f'/api/data?{query}',
+        'data_columnar': f'/api/data?{query}&format=columnar',
+        'data_window': f'/api/data?{query}&window=15',
+        'data_patch': f'/api/data?{query}&since={since}',
+        'history': f'/api/history?{query}&resolution=1m',
+        'analytics': f'/api/analytics?{query}',
+    }
+    headers = {'data_gzip': {'Accept-Encoding': 'gzip, br'}, 'data_columnar': {'Accept-Encoding': 'gzip, br'}}
+
+    results = {}
+    for name, url in routes.items():
+        def worker(count):
+            client = app.app.test_client()
+            timings = []
+            for _ in range(count):
+                start = time.perf_counter()
+                response = client.get(url, headers=headers.get(name, {}))
+                response.get_data()
+                timings.append(time.perf_counter() - start)
+                if response.status_code >= 500:
+                    raise RuntimeError(f'{url} returned {response.status_code}')
+            return timings
+
+        per_worker = max(requests // concurrency, 1)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            timings = [t for batch in executor.map(worker, [per_worker] * concurrency) for t in batch]
+        elapsed = time.perf_counter() - start
+        results[name] = dict(summarize(timings), rps=round(len(timings) / elapsed, 1))
+    return results
+
+
+def print_table(title, rows):
+    print(f'\n{title}')
+    for name, stats in rows.items():
+        print(f'  {str(name):<14} ' + '  '.join(f'{key}={value}' for key, value in stats.items()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the refresh and serving paths.')
+    parser.add_argument('--strikes', default='11,101,251,501', help='comma-separated chain sizes for the transform benchmark')
+    parser.add_argument('--underlyings', type=int, default=8, help='synthetic underlyings refreshed per tick')
+    parser.add_argument('--refresh-strikes', type=int, default=201, help='chain size used for the refresh and route benchmarks')
+    parser.add_argument('--ticks', type=int, default=20, help='refresh ticks to time')
+    parser.add_argument('--repeat', type=int, default=200, help='iterations per transform size')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients per route')
+    parser.add_argument('--replay', help='recorded option_chain response(s): a JSON file or a directory of them')
+    parser.add_argument('--mongo-uri', help='scratch mongod to use instead of mongomock (its market_data db is written to)')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    recorded = load_recorded(args.replay) if args.replay else None
+    if recorded:
+        # Recorded chains keep their own size
+        responses_by_size = {f'recorded({len(recorded[0]["data"]["data"]["oc"])})': recorded}
+        refresh_responses = recorded
+    else:
+        sizes = [int(size) for size in args.strikes.split(',')]
+        responses_by_size = {size: [synthetic_response(size, seed=seed) for seed in range(10)] for size in sizes}
+        refresh_responses = [synthetic_response(args.refresh_strikes, seed=seed) for seed in range(32)]
+
+    results = {'transform': bench_transform(responses_by_size, args.repeat)}
+    print_table('build_chain() per chain', results['transform'])
+    results['greeks'] = bench_greeks(responses_by_size, args.repeat)
+    print_table('GreeksEngine.fill() per chain, every IV solved', results['greeks'])
+
+    use_mongo(args.mongo_uri)
+    app, instruments, expiry = load_app(args.underlyings)
+    refresh = bench_refresh(app, args.ticks, refresh_responses)
+    app.store.flush()  # The remaining benchmarks read what the refresh wrote
+    results['refresh'] = dict(refresh, chains_per_tick=args.underlyings,
+                              per_chain_p50_ms=round(refresh['p50_ms'] / args.underlyings, 3))
+    print_table('update_cache() per tick (fetch stub + transform + store + publish)', {'tick': results['refresh']})
+
+    results['generate_html'] = bench_generate_html(app, min(args.repeat, 100))
+    print_table('upload.generate_html()', {'render': results['generate_html']})
+
+    results['routes'] = bench_routes(app, instruments, expiry, args.requests, args.concurrency)
+    print_table(f'Flask routes ({args.concurrency} concurrent clients)', results['routes'])
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    app.fetcher.shutdown()
+    app.dhan_client.close()
+    return results
+
+
+if __name__ == '__main__':
+    main()
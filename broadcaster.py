@@ -0,0 +1,104 @@
+import logging
+import queue
+import threading
+
+
+def sse_message(data, event=None):
+    """Format one Server-Sent Events message; `data` is bytes (already serialized JSON)."""
+    lines = []
+    if event:
+        lines.append(f'event: {event}\n'.encode('utf-8'))
+    for line in data.splitlines() or [b'']:
+        lines.append(b'data: ' + line + b'\n')
+    return b''.join(lines) + b'\n'
+
+
+# Fan-out of pre-formatted messages to every stream connected to a channel.
+#
+# Each subscriber owns a small bounded queue; a slow client only ever misses
+# intermediate snapshots (the oldest queued message is dropped), it never
+# blocks the publisher. Messages are formatted once by the caller and shared
+# by all subscribers.
+#
+# At most `max_subscribers` streams are open at once (None for no limit);
+# subscribe() returns None beyond that, so a worker keeps threads free for
+# ordinary requests.
+class Broadcaster:
+    def __init__(self, queue_size=4, heartbeat=15, on_idle=None, max_subscribers=None):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.heartbeat = heartbeat
+        self.on_idle = on_idle
+        self._subscribers = {}  # channel -> set of queues
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel=None):
+        """A new subscriber queue for `channel`, or None when `max_subscribers` streams are already open."""
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            if self.max_subscribers is not None and self._count() >= self.max_subscribers:
+                return None
+            self._subscribers.setdefault(channel, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber, channel=None):
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[channel]
+
+    def publish(self, message, channel=None):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscriber in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait(message)
+                    break
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+        return len(subscribers)
+
+    def stream(self, initial=None, channel=None, subscriber=None):
+        """Generator for a streaming response: `initial`, then every message published to `channel`.
+
+        Pass a `subscriber` from subscribe() to check the limit before the
+        response starts; it is unsubscribed when the generator finishes.
+        """
+        if subscriber is None:
+            subscriber = self.subscribe(channel)
+            if subscriber is None:
+                return
+        try:
+            if initial is not None:
+                yield initial
+            while True:
+                try:
+                    yield subscriber.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield b': keep-alive\n\n'
+                    if self.on_idle is not None:
+                        try:
+                            self.on_idle(channel)
+                        except Exception as e:
+                            logging.error("Broadcaster idle callback failed: %s", e)
+        finally:
+            self.unsubscribe(subscriber, channel)
+
+    def channels(self):
+        """Channels with at least one subscriber."""
+        with self._lock:
+            return list(self._subscribers)
+
+    def subscriber_count(self):
+        with self._lock:
+            return self._count()
+
+    def _count(self):
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
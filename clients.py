@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+from functools import lru_cache
+
+import boto3
+import requests
+from botocore.config import Config
+from pymongo import MongoClient
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Shared, process-wide clients for the maintenance scripts (upload.py, the DNS
+# scripts and the switchover). Each is built once and reused, so a single
+# process that publishes to S3 and then flips DNS pays for one Mongo pool, one
+# S3 connection pool and one HTTP keep-alive pool. Every client has explicit
+# timeouts; none of them can hang a cron job.
+
+MONGO_TIMEOUT_MS = int(os.getenv('MONGO_TIMEOUT_MS', '5000'))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '3.05'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '10'))
+
+IMDS_BASE = os.getenv('IMDS_BASE', 'http://169.254.169.254/latest')
+IMDS_TOKEN_TTL = 21600  # seconds, the IMDSv2 maximum
+IMDS_TOKEN_MARGIN = 60  # refresh this long before the token expires
+
+
+@lru_cache(maxsize=None)
+def get_mongo_client(uri):
+    return MongoClient(
+        uri,
+        maxPoolSize=10,
+        serverSelectionTimeoutMS=MONGO_TIMEOUT_MS,
+        connectTimeoutMS=MONGO_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_TIMEOUT_MS * 2,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_s3_client(region=None, endpoint_url=None, access_key=None, secret_key=None):
+    config = Config(
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=HTTP_READ_TIMEOUT,
+        retries={'max_attempts': 3, 'mode': 'standard'},
+        max_pool_connections=16,  # matches the parallel uploads in upload.py
+    )
+    return boto3.client(
+        's3',
+        region_name=region or None,
+        endpoint_url=endpoint_url or None,
+        aws_access_key_id=access_key or None,
+        aws_secret_access_key=secret_key or None,
+        config=config,
+    )
+
+
+class TimeoutSession(requests.Session):
+    """requests.Session that applies a default (connect, read) timeout to every request."""
+
+    def __init__(self, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+@lru_cache(maxsize=None)
+def get_http_session():
+    session = TimeoutSession()
+    # Connection errors and 5xx/429 responses on idempotent methods are retried with backoff
+    retry = Retry(total=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# IMDSv2 session token, reused until shortly before its TTL runs out
+class ImdsTokenCache:
+    def __init__(self, ttl=IMDS_TOKEN_TTL, base=IMDS_BASE):
+        self.ttl = ttl
+        self.base = base
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, force=False):
+        with self._lock:
+            if force or self._token is None or time.monotonic() >= self._expires_at - IMDS_TOKEN_MARGIN:
+                # IMDS is link-local; fail fast rather than wait on the default timeouts
+                response = get_http_session().put(
+                    f'{self.base}/api/token',
+                    headers={'X-aws-ec2-metadata-token-ttl-seconds': str(self.ttl)},
+                    timeout=(1, 2),
+                )
+                response.raise_for_status()
+                self._token = response.text
+                self._expires_at = time.monotonic() + self.ttl
+            return self._token
+
+    def metadata(self, path):
+        response = self._get(path, self.get())
+        if response.status_code == 401:
+            # The token was revoked or the instance restarted; fetch a new one once
+            response = self._get(path, self.get(force=True))
+        response.raise_for_status()
+        return response.text.strip()
+
+    def _get(self, path, token):
+        return get_http_session().get(
+            f'{self.base}/meta-data/{path}',
+            headers={'X-aws-ec2-metadata-token': token},
+            timeout=(1, 2),
+        )
+
+
+imds = ImdsTokenCache()
@@ -0,0 +1,57 @@
+import os
+
+from clients import get_http_session
+
+# Point CLOUDFLARE_API_BASE at a local stand-in to exercise the DNS scripts without touching the zone
+API_BASE = os.getenv("CLOUDFLARE_API_BASE", "https://api.cloudflare.com/client/v4").rstrip("/")
+
+
+class CloudflareError(Exception):
+    pass
+
+
+# Minimal Cloudflare zone client for the DNS switchover. The ensure_* methods
+# read the current state first and only write when it differs, so repeated
+# runs cost one GET each and never touch the zone.
+class CloudflareZone:
+    def __init__(self, api_token, zone_id, api_base=API_BASE):
+        self.zone_id = zone_id
+        self.api_base = api_base
+        self.headers = {
+            "Authorization": f"Bearer {api_token}",
+            "Content-Type": "application/json",
+        }
+
+    def _request(self, method, path, action, **kwargs):
+        url = f"{self.api_base}/zones/{self.zone_id}/{path}"
+        response = get_http_session().request(method, url, headers=self.headers, **kwargs)
+        if response.status_code != 200:
+            raise CloudflareError(f"Failed to {action}: {response.text}")
+        return response.json().get("result")
+
+    def get_record(self, name):
+        records = self._request("GET", "dns_records", "fetch DNS records", params={"name": name})
+        if not records:
+            raise CloudflareError(f"No existing DNS record found for {name}")
+        return records[0]
+
+    def ensure_record(self, name, record_type, content, proxied=True):
+        """Point `name` at `content`; returns True if the record was changed."""
+        record = self.get_record(name)
+        if (record["type"], record["content"], record.get("proxied")) == (record_type, content, proxied):
+            return False
+        self._request(
+            "PUT", f"dns_records/{record['id']}", f"update {record_type} record",
+            json={"type": record_type, "name": name, "content": content, "ttl": 1, "proxied": proxied},  # ttl 1 = auto
+        )
+        return True
+
+    def get_ssl_mode(self):
+        return self._request("GET", "settings/ssl", "fetch SSL mode")["value"]
+
+    def ensure_ssl_mode(self, mode):
+        """Set the zone's SSL/TLS encryption mode; returns True if it was changed."""
+        if self.get_ssl_mode() == mode:
+            return False
+        self._request("PATCH", "settings/ssl", "update SSL mode", json={"value": mode})
+        return True
@@ -0,0 +1,97 @@
+from bisect import bisect_left
+
+from transform import ROW_COLUMNS, derive_columns, normalize_chain
+
+# Columnar snapshot format: one array per display field instead of one dict per
+# strike, so field names are stored and sent once per snapshot rather than once
+# per row.
+#
+#   {'schema': 1, 'strikes': [...], 'fields': {'CLTP': [...], 'CEOI': [...], ...}}
+#
+# `strikes` holds the STP column, sorted ascending; every array in `fields` is
+# aligned with it. Snapshots keep the full chain in this layout (`chain` in
+# memory, `columns` in MongoDB) and the rows of the default ATM window in
+# `data`; any other window is sliced from the chain on demand.
+#
+# Stored documents only carry `columns`: the full chain plus `window`, the
+# default window to expand. Documents written before full chains were kept
+# hold just the window in `columns` (no `window` field), and older ones only
+# the row list `data`; readers go through expand() so all three are handled.
+SCHEMA_VERSION = 1
+
+
+def rows_to_columns(rows):
+    return {
+        'schema': SCHEMA_VERSION,
+        'strikes': [row['STP'] for row in rows],
+        'fields': {name: [row.get(name) for row in rows] for name in ROW_COLUMNS if name != 'STP'},
+    }
+
+
+def columns_to_rows(columns):
+    if columns.get('schema') != SCHEMA_VERSION:
+        raise ValueError(f"Unsupported columnar snapshot schema: {columns.get('schema')}")
+    fields = columns['fields']
+    names = ['STP'] + list(fields)
+    return [dict(zip(names, values)) for values in zip(columns['strikes'], *fields.values())]
+
+
+def build_chain(option_chain, fill=None):
+    """Transform a raw option chain into the columnar layout, every strike included.
+
+    `fill(frame)` may complete the normalized chain in place first, e.g. GreeksEngine.fill.
+    """
+    frame = normalize_chain(option_chain)
+    if fill is not None:
+        fill(frame)
+    derived = derive_columns(frame)
+    return {
+        'schema': SCHEMA_VERSION,
+        'strikes': derived['STP'].tolist(),
+        'fields': {name: derived[name].to_numpy().tolist() for name in ROW_COLUMNS if name != 'STP'},
+    }
+
+
+def slice_window(columns, atm_strike, window):
+    """The `window` strikes either side of the strike nearest `atm_strike`, in O(window)."""
+    strikes = columns['strikes']
+    if not strikes:
+        return columns
+    centre = bisect_left(strikes, atm_strike)
+    if centre == len(strikes) or (centre > 0 and atm_strike - strikes[centre - 1] < strikes[centre] - atm_strike):
+        centre -= 1
+    lo, hi = max(centre - window, 0), centre + window + 1
+    return {
+        'schema': columns['schema'],
+        'strikes': strikes[lo:hi],
+        'fields': {name: values[lo:hi] for name, values in columns['fields'].items()},
+    }
+
+
+def with_window(document, window):
+    """Shallow copy of `document` whose rows cover `window` strikes either side of ATM."""
+    chain = document.get('chain') or rows_to_columns(document['data'])
+    return dict(document, data=columns_to_rows(slice_window(chain, document['atm_strike'], window)))
+
+
+def compact(document):
+    """Copy of `document` as stored: `columns` (the full chain when known) replaces the rows."""
+    stored = {key: value for key, value in document.items() if key not in ('data', 'chain')}
+    if 'chain' in document:
+        stored['columns'] = document['chain']
+    else:
+        stored['columns'] = rows_to_columns(document['data'])
+        stored.pop('window', None)
+    return stored
+
+
+def expand(document):
+    """Give a stored document its chain and default-window rows back; row-format documents pass through."""
+    if document is None or 'data' in document or 'columns' not in document:
+        return document
+    columns = document.pop('columns')
+    if 'window' in document:
+        document['chain'] = columns
+        columns = slice_window(columns, document['atm_strike'], document['window'])
+    document['data'] = columns_to_rows(columns)
+    return document
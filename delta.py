@@ -0,0 +1,43 @@
+# Cell-level patches between two snapshots, keyed by strike price (STP).
+#
+# A patch lists the cells that changed in rows present in both snapshots,
+# the full rows that entered the window and the strikes that left it (the
+# ATM window shifts as the underlying moves). Clients holding snapshot
+# `since` apply it to reach snapshot `snapshot_id`.
+
+
+def index_rows(rows):
+    return {row['STP']: row for row in rows}
+
+
+def diff_rows(old_rows, new_rows):
+    """Return (changed, added, removed) between two row lists."""
+    old_index = index_rows(old_rows)
+    new_index = index_rows(new_rows)
+
+    changed = []
+    added = []
+    for strike, row in new_index.items():
+        previous = old_index.get(strike)
+        if previous is None:
+            added.append(row)
+            continue
+        cells = {field: value for field, value in row.items() if previous.get(field) != value}
+        if cells:
+            changed.append([strike, cells])
+
+    removed = [strike for strike in old_index if strike not in new_index]
+    return changed, added, removed
+
+
+def build_patch(old_document, new_document, old_id, new_id):
+    changed, added, removed = diff_rows(old_document['data'], new_document['data'])
+    return {
+        'since': old_id,
+        'snapshot_id': new_id,
+        'atm_strike': new_document['atm_strike'],
+        'timestamp': new_document['timestamp'],
+        'changed': changed,
+        'added': added,
+        'removed': removed,
+    }
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.adapters import HTTPAdapter
+
+from fetcher import RateLimiter
+from metrics import DHAN_CLIENT_CALLS
+
+# Point DHAN_API_BASE at dhan_stub.py to replay recorded responses instead of calling Dhan
+DHAN_API_BASE = os.getenv('DHAN_API_BASE')
+
+
+# Asyncio front for the synchronous dhanhq client.
+#
+# Identical requests (same method and arguments) in flight at the same time
+# share one upstream call (single-flight), and successful responses are
+# served from memory for `ttl` seconds. Only real upstream calls wait for
+# the per-request rate limit slot, so coalesced and cached callers never
+# sleep. The blocking dhanhq calls run on a small thread pool over one
+# requests session with a pooled keep-alive adapter.
+class AsyncDhanClient:
+    def __init__(self, dhan, ttl=2.0, min_interval=3.0, max_workers=8, api_base=DHAN_API_BASE):
+        self.dhan = dhan
+        self.ttl = ttl
+        self.limiter = RateLimiter(min_interval)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='dhan-call')
+        self._inflight = {}  # request key -> asyncio.Future, touched only on the event loop
+        self._cache = {}  # request key -> (expires_at, response)
+        if api_base:
+            dhan.base_url = api_base.rstrip('/')
+        # One connection per worker stays open between ticks
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        dhan.session.mount('https://', adapter)
+        dhan.session.mount('http://', adapter)
+
+    async def option_chain(self, under_security_id, under_exchange_segment, expiry):
+        return await self._request('option_chain', under_security_id=under_security_id,
+                                   under_exchange_segment=under_exchange_segment, expiry=expiry)
+
+    async def expiry_list(self, under_security_id, under_exchange_segment):
+        return await self._request('expiry_list', under_security_id=under_security_id,
+                                   under_exchange_segment=under_exchange_segment)
+
+    async def _request(self, method, **kwargs):
+        key = (method,) + tuple(sorted(kwargs.items()))
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            DHAN_CLIENT_CALLS.inc(method=method, result='cached')
+            return cached[1]
+
+        future = self._inflight.get(key)
+        if future is not None:
+            DHAN_CLIENT_CALLS.inc(method=method, result='coalesced')
+            return await asyncio.shield(future)
+
+        loop = asyncio.get_running_loop()
+        future = self._inflight[key] = loop.create_future()
+        try:
+            response = await loop.run_in_executor(self.executor, self._call, key, method, kwargs)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Retrieved here so waiter-less failures are not logged as unhandled
+            raise
+        else:
+            if self.ttl > 0 and response.get('status') == 'success':
+                self._store(key, response)
+            future.set_result(response)
+            return response
+        finally:
+            del self._inflight[key]
+
+    def _call(self, key, method, kwargs):
+        self.limiter.wait(key)
+        DHAN_CLIENT_CALLS.inc(method=method, result='upstream')
+        return getattr(self.dhan, method)(**kwargs)
+
+    def _store(self, key, response):
+        now = time.monotonic()
+        # Expired entries go on every store, so past expiries do not pile up
+        for stale in [stale for stale, (expires_at, _) in self._cache.items() if expires_at <= now]:
+            del self._cache[stale]
+        self._cache[key] = (now + self.ttl, response)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.dhan.session.close()
+
+
+# Blocking facade with dhanhq's method signatures, for the scheduler and
+# fetcher threads. Every call is handed to one event loop running in a
+# daemon thread, so callers in different threads coalesce with each other.
+class DhanClient:
+    def __init__(self, dhan, timeout=90, **options):
+        self.client = AsyncDhanClient(dhan, **options)
+        self.timeout = timeout
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='dhan-async', daemon=True)
+        self._thread.start()
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(self.timeout)
+
+    def option_chain(self, under_security_id, under_exchange_segment, expiry):
+        return self._run(self.client.option_chain(under_security_id, under_exchange_segment, expiry))
+
+    def expiry_list(self, under_security_id, under_exchange_segment):
+        return self._run(self.client.expiry_list(under_security_id, under_exchange_segment))
+
+    def close(self):
+        try:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        except RuntimeError as e:
+            logging.debug("Dhan client loop already closed: %s", e)
+        self.client.close()
@@ -0,0 +1,134 @@
+import argparse
+import glob
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the two Dhan endpoints the app calls, replaying recorded
+# responses so the fetch path can be exercised without credentials or rate
+# limits:
+#
+#   python dhan_stub.py recorded/ --port 8765 --delay 0.2
+#   DHAN_API_BASE=http://127.0.0.1:8765 python app.py
+#
+# Recordings are JSON files holding full option_chain responses as dhanhq
+# returns them ({"status": "success", "data": {"data": {"last_price", "oc"}}},
+# the same files benchmark.py --replay reads). Each underlying/expiry pair
+# cycles through them in name order, one per request. GET /stats reports the
+# requests served per endpoint, so tests can assert how often "Dhan" was hit.
+
+
+class ReplayState:
+    def __init__(self, responses, expiries, delay=0.0):
+        self.responses = responses
+        self.expiries = expiries
+        self.delay = delay
+        self.counts = {}
+        self._cycles = {}
+        self._lock = threading.Lock()
+
+    def next_chain(self, key):
+        with self._lock:
+            self.counts['optionchain'] = self.counts.get('optionchain', 0) + 1
+            cycle = self._cycles.get(key)
+            if cycle is None:
+                cycle = self._cycles[key] = itertools.cycle(self.responses)
+            return next(cycle)
+
+    def expiry_list(self):
+        with self._lock:
+            self.counts['expirylist'] = self.counts.get('expirylist', 0) + 1
+        return {'data': self.expiries, 'status': 'success'}
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        state = self.server.state
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._send(400, {'errorType': 'Input_Exception', 'errorMessage': 'Invalid JSON'})
+        if state.delay:
+            time.sleep(state.delay)
+        path = self.path.rstrip('/')
+        if path.endswith('/optionchain/expirylist'):
+            return self._send(200, state.expiry_list())
+        if path.endswith('/optionchain'):
+            key = (request.get('UnderlyingScrip'), request.get('UnderlyingSeg'), request.get('Expiry'))
+            # dhanhq wraps the API body as 'data'; replay the body itself
+            return self._send(200, state.next_chain(key)['data'])
+        self._send(404, {'errorType': 'Not_Found', 'errorMessage': self.path})
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/stats':
+            return self._send(200, self.server.state.stats())
+        self._send(404, {'errorType': 'Not_Found', 'errorMessage': self.path})
+
+    def log_message(self, format, *args):
+        logging.debug("dhan_stub: " + format, *args)
+
+
+def load_responses(path):
+    paths = sorted(glob.glob(os.path.join(path, '*.json'))) if os.path.isdir(path) else [path]
+    responses = []
+    for name in paths:
+        with open(name) as f:
+            responses.append(json.load(f))
+    if not responses:
+        raise SystemExit(f"No recorded responses found in {path}")
+    return responses
+
+
+def make_server(responses, expiries=None, delay=0.0, host='127.0.0.1', port=0):
+    """Build (not start) a stub server; port 0 picks a free port, see server.server_address."""
+    if not expiries:
+        expiries = [(date.today() + timedelta(days=7)).isoformat()]
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.state = ReplayState(responses, expiries, delay)
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay recorded Dhan option chain responses over HTTP.')
+    parser.add_argument('recorded', help='a recorded option_chain response, or a directory of them')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds to wait before each response')
+    parser.add_argument('--expiries', help="comma-separated 'YYYY-MM-DD' dates for the expiry list (default: a week out)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    expiries = args.expiries.split(',') if args.expiries else None
+    server = make_server(load_responses(args.recorded), expiries, args.delay, args.host, args.port)
+    logging.info("Replaying %d response(s) on http://%s:%d", len(server.state.responses), *server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import pytz
+
+from metrics import DHAN_REQUEST_SECONDS
+from resilience import AttemptStats, CircuitBreaker, CircuitOpenError
+
+IST = pytz.timezone('Asia/Kolkata')
+
+
+# Minimum spacing between calls sharing a key. Dhan allows one option chain
+# request per underlying/expiry every 3 seconds.
+class RateLimiter:
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._next_allowed = {}
+        self._lock = threading.Lock()
+
+    def wait(self, key):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_allowed.get(key, now))
+            self._next_allowed[key] = slot + self.min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# Issues option chain calls for every registered (underlying, expiry) pair
+# concurrently through a thread pool, each pair behind its own rate limit
+# and circuit breaker.
+class OptionChainFetcher:
+    def __init__(self, dhan, instruments, max_workers=8, min_interval=3.0, failure_threshold=5, reset_timeout=60):
+        self.dhan = dhan
+        self.instruments = instruments
+        self.limiter = RateLimiter(min_interval)
+        self.stats = AttemptStats()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='option-chain')
+        self._expiries = {}  # underlying name -> (IST date resolved, [expiry, ...])
+        self._lock = threading.Lock()
+
+    def expiries(self, instrument):
+        """Expiry dates followed for `instrument`, resolved from Dhan once per trading day."""
+        configured = instrument.get('expiries', 1)
+        if isinstance(configured, list):
+            return configured
+
+        today = datetime.now(IST).date()
+        with self._lock:
+            cached = self._expiries.get(instrument['name'])
+        if cached and cached[0] == today:
+            return cached[1]
+
+        self.limiter.wait(('expiry_list', instrument['name']))
+        response = self.dhan.expiry_list(
+            under_security_id=instrument['security_id'],
+            under_exchange_segment=instrument['segment'],
+        )
+        if response.get('status') != 'success':
+            logging.error("Failed to fetch expiry list for %s: %s", instrument['name'], response)
+            # Keep serving yesterday's list rather than dropping the underlying
+            return cached[1] if cached else []
+
+        upcoming = sorted(expiry for expiry in response['data']['data'] if expiry >= today.isoformat())
+        selected = upcoming[:configured]
+        with self._lock:
+            self._expiries[instrument['name']] = (today, selected)
+        return selected
+
+    def jobs(self):
+        """All (instrument, expiry) pairs to refresh this tick."""
+        jobs = []
+        for instrument in self.instruments:
+            try:
+                expiries = self.expiries(instrument)
+            except Exception as e:
+                logging.error("Exception resolving expiries for %s: %s", instrument['name'], e)
+                continue
+            jobs.extend((instrument, expiry) for expiry in expiries)
+        return jobs
+
+    def breaker(self, key):
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = self._breakers[key] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return breaker
+
+    def fetch(self, instrument, expiry):
+        """Fetch one option chain, waiting for its rate limit slot first.
+
+        Raises CircuitOpenError without calling Dhan while the pair's breaker is open.
+        """
+        key = (instrument['name'], expiry)
+        breaker = self.breaker(key)
+        if not breaker.allow():
+            self.stats.record_skip(key)
+            raise CircuitOpenError(f"Circuit open for {instrument['name']} {expiry}")
+
+        self.limiter.wait(key)
+        start = time.monotonic()
+        try:
+            response = self.dhan.option_chain(
+                under_security_id=instrument['security_id'],
+                under_exchange_segment=instrument['segment'],
+                expiry=expiry,
+            )
+        except Exception:
+            breaker.record_failure()
+            latency = time.monotonic() - start
+            self.stats.record_attempt(key, latency, success=False)
+            DHAN_REQUEST_SECONDS.observe(latency, underlying=instrument['name'], outcome='exception')
+            raise
+
+        success = response.get('status') == 'success'
+        if success:
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+        latency = time.monotonic() - start
+        self.stats.record_attempt(key, latency, success)
+        DHAN_REQUEST_SECONDS.observe(latency, underlying=instrument['name'], outcome='success' if success else 'error')
+        return response
+
+    def run(self, task):
+        """Run `task(instrument, expiry)` for every job concurrently and wait for all of them."""
+        futures = {self.executor.submit(task, instrument, expiry): (instrument, expiry) for instrument, expiry in self.jobs()}
+        for future in as_completed(futures):
+            instrument, expiry = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logging.error("Refresh of %s %s failed: %s", instrument['name'], expiry, e)
+
+    def export_stats(self):
+        """Attempt counters, latencies and breaker state per underlying/expiry."""
+        stats = self.stats.snapshot()
+        exported = {}
+        for (name, expiry), entry in stats.items():
+            entry['breaker'] = self.breaker((name, expiry)).state
+            exported[f'{name}:{expiry}'] = entry
+        return exported
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,211 @@
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from market_calendar import IST, MarketCalendar
+
+# Annualised continuously compounded rates for the pricing model
+RISK_FREE_RATE = float(os.getenv('RISK_FREE_RATE', '0.065'))
+DIVIDEND_YIELD = float(os.getenv('DIVIDEND_YIELD', '0'))
+
+MINUTES_PER_YEAR = 365 * 24 * 60
+MIN_YEARS = 1 / MINUTES_PER_YEAR  # expiring options are valued with at least a minute left
+MIN_VOL = 1e-4
+MAX_VOL = 5.0
+
+# Greek columns of the normalized chain (see transform.normalize_chain), per leg
+FILLED_COLUMNS = ('iv', 'delta', 'gamma', 'theta', 'vega')
+
+
+def years_to_expiry(expiry, now=None):
+    """Calendar years from `now` to the close of trading on `expiry` ('YYYY-MM-DD')."""
+    now = now or datetime.now(IST)
+    close = IST.localize(datetime.combine(datetime.strptime(expiry, '%Y-%m-%d').date(), MarketCalendar.market_close))
+    return max((close - now).total_seconds() / 60 / MINUTES_PER_YEAR, MIN_YEARS)
+
+
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / np.sqrt(2 * np.pi)
+
+
+def norm_cdf(x):
+    # Chebyshev fit of erfc (Numerical Recipes erfcc), fractional error below 1.2e-7 even far in the tails
+    z = np.abs(x) / np.sqrt(2)
+    t = 1 / (1 + 0.5 * z)
+    poly = (-1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (0.09678418 + t * (-0.18628806 + t * (
+        0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (-0.82215223 + t * 0.17087277)))))))))
+    tail = 0.5 * t * np.exp(-z * z + poly)
+    return np.where(x >= 0, 1 - tail, tail)
+
+
+# Generalised Black-Scholes with cost of carry `carry`: carry = rate - yield
+# prices options on a spot index or stock (Black-Scholes-Merton), carry = 0
+# prices options on a future (Black-76). All functions take numpy arrays and
+# broadcast; `is_call` is a boolean array.
+def _d1_d2(spot, strike, years, vol, carry):
+    root = vol * np.sqrt(years)
+    d1 = (np.log(spot / strike) + (carry + 0.5 * vol * vol) * years) / root
+    return d1, d1 - root
+
+
+def price(spot, strike, years, vol, is_call, rate=RISK_FREE_RATE, carry=RISK_FREE_RATE - DIVIDEND_YIELD):
+    d1, d2 = _d1_d2(spot, strike, years, vol, carry)
+    forward = spot * np.exp((carry - rate) * years)
+    discount = np.exp(-rate * years)
+    call = forward * norm_cdf(d1) - strike * discount * norm_cdf(d2)
+    put = strike * discount * norm_cdf(-d2) - forward * norm_cdf(-d1)
+    return np.where(is_call, call, put)
+
+
+def _vega(spot, strike, years, vol, rate, carry):
+    d1, _ = _d1_d2(spot, strike, years, vol, carry)
+    return spot * np.exp((carry - rate) * years) * norm_pdf(d1) * np.sqrt(years)
+
+
+def implied_vol(target, spot, strike, years, is_call, rate=RISK_FREE_RATE, carry=RISK_FREE_RATE - DIVIDEND_YIELD,
+                guess=None, tol=1e-6, max_iter=60):
+    """Solve price(vol) = target for every element at once; NaN where no volatility fits.
+
+    In-the-money prices are turned into the out-of-the-money price of the
+    other side through put-call parity first, since their time value is
+    what pins the volatility down. Newton steps are taken while they stay
+    inside the bracket [lo, hi] that each iteration narrows, bisection steps
+    otherwise, so every element converges even where vega is tiny.
+    """
+    target, strike, is_call = np.broadcast_arrays(np.asarray(target, dtype=float), np.asarray(strike, dtype=float),
+                                                  np.asarray(is_call, dtype=bool))
+    forward = spot * np.exp((carry - rate) * years)
+    discount = np.exp(-rate * years)
+    parity = forward - strike * discount  # call - put
+    in_the_money = np.where(is_call, parity > 0, parity < 0)
+    target = np.where(in_the_money, target - np.where(is_call, parity, -parity), target)
+    is_call = is_call ^ in_the_money
+    upper = np.where(is_call, forward, strike * discount)
+    solvable = (target > 0) & (target < upper)
+
+    lo = np.full(target.shape, MIN_VOL)
+    hi = np.full(target.shape, MAX_VOL)
+    # Brenner-Subrahmanyam approximation for at-the-money options, where no better guess is given
+    approximate = np.sqrt(2 * np.pi / years) * target / np.maximum(forward, 1e-12)
+    guess = approximate if guess is None else np.where(np.isfinite(guess), guess, approximate)
+    vol = np.clip(np.nan_to_num(guess, nan=0.2), MIN_VOL * 2, MAX_VOL / 2)
+    vol = np.broadcast_to(vol, target.shape).copy()
+    active = solvable.copy()
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        k, sigma = strike[active], vol[active]
+        diff = price(spot, k, years, sigma, is_call[active], rate, carry) - target[active]
+        lo[active] = np.where(diff < 0, sigma, lo[active])
+        hi[active] = np.where(diff > 0, sigma, hi[active])
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            newton = sigma - diff / _vega(spot, k, years, sigma, rate, carry)
+        inside = np.isfinite(newton) & (newton > lo[active]) & (newton < hi[active])
+        vol[active] = np.where(inside, newton, (lo[active] + hi[active]) / 2)
+        done = (np.abs(diff) < tol * np.maximum(target[active], 1)) | (hi[active] - lo[active] < tol)
+        active[np.flatnonzero(active)[done]] = False
+    return np.where(solvable, vol, np.nan)
+
+
+def greeks(spot, strike, years, vol, is_call, rate=RISK_FREE_RATE, carry=RISK_FREE_RATE - DIVIDEND_YIELD):
+    """Delta, gamma, theta (per calendar day) and vega (per vol point), quoted the way Dhan quotes them."""
+    d1, d2 = _d1_d2(spot, strike, years, vol, carry)
+    carry_discount = np.exp((carry - rate) * years)
+    discount = np.exp(-rate * years)
+    density = norm_pdf(d1)
+    root = np.sqrt(years)
+    delta = np.where(is_call, carry_discount * norm_cdf(d1), carry_discount * (norm_cdf(d1) - 1))
+    gamma = carry_discount * density / (spot * vol * root)
+    decay = -spot * carry_discount * density * vol / (2 * root)
+    call_theta = decay - (carry - rate) * spot * carry_discount * norm_cdf(d1) - rate * strike * discount * norm_cdf(d2)
+    put_theta = decay + (carry - rate) * spot * carry_discount * norm_cdf(-d1) + rate * strike * discount * norm_cdf(-d2)
+    theta = np.where(is_call, call_theta, put_theta) / 365
+    vega = spot * carry_discount * density * root / 100
+    return {'delta': delta, 'gamma': gamma, 'theta': theta, 'vega': vega}
+
+
+# Fills the IV and Greek columns Dhan leaves empty (zero or missing) in a
+# normalized chain, for both legs of every strike at once.
+#
+# IV is solved from the leg's LTP only where Dhan gives none; the Greeks are
+# then computed from Dhan's IV or the solved one. Solved IVs are kept per
+# underlying/expiry and reused for legs whose (strike, LTP) input has not
+# changed since the previous tick at the same spot and minute to expiry;
+# the rest start Newton from the previous tick's IV for that strike.
+class GreeksEngine:
+    def __init__(self, rate=RISK_FREE_RATE, dividend_yield=DIVIDEND_YIELD):
+        self.rate = rate
+        self.carry = rate - dividend_yield
+        self.solved = 0
+        self.reused = 0
+        self._previous = {}  # key -> (context, strikes, is_call, prices, ivs)
+        self._lock = threading.Lock()
+
+    def fill(self, frame, key, spot, years, futures=False):
+        """Complete `frame` in place; `futures` prices the legs off a futures quote (Black-76)."""
+        if spot is None or spot <= 0 or frame.empty:
+            return frame
+        carry = 0.0 if futures else self.carry
+        strikes = frame['strike'].to_numpy(dtype=float)
+        strike = np.concatenate([strikes, strikes])
+        is_call = np.concatenate([np.ones(len(strikes), bool), np.zeros(len(strikes), bool)])
+        ltp = np.concatenate([frame['ce_ltp'].to_numpy(dtype=float), frame['pe_ltp'].to_numpy(dtype=float)])
+        quoted = np.concatenate([frame['ce_iv'].to_numpy(dtype=float), frame['pe_iv'].to_numpy(dtype=float)]) / 100
+
+        missing = ~(quoted > 0)
+        iv = np.where(missing, np.nan, quoted)
+        context = (spot, round(years * MINUTES_PER_YEAR), self.rate, carry)
+        if missing.any():
+            iv[missing] = self._solve(key, context, strike, is_call, ltp, missing, spot, years, carry)
+
+        computed = greeks(spot, strike, years, np.where(iv > 0, iv, np.nan), is_call, self.rate, carry)
+        computed['iv'] = iv * 100
+        half = len(strikes)
+        for name in FILLED_COLUMNS:
+            values = computed[name]
+            for prefix, leg in (('ce_', values[:half]), ('pe_', values[half:])):
+                column = prefix + name
+                current = frame[column].to_numpy(dtype=float) if column in frame else np.zeros(half)
+                empty = ~(np.abs(current) > 0) & np.isfinite(leg)
+                frame[column] = np.where(empty, leg, np.nan_to_num(current))
+        return frame
+
+    def _solve(self, key, context, strike, is_call, ltp, missing, spot, years, carry):
+        strike, is_call, ltp = strike[missing], is_call[missing], ltp[missing]
+        result = np.full(len(strike), np.nan)
+        known = np.zeros(len(strike), dtype=bool)
+        guess = None
+        with self._lock:
+            previous = self._previous.get(key)
+        if previous is not None:
+            previous_context, previous_strike, previous_call, previous_ltp, previous_iv = previous
+            guess = np.full(len(strike), np.nan)
+            # Match legs on (strike, side); both ticks list each side's strikes in ascending order
+            for side in (True, False):
+                current = np.flatnonzero(is_call == side)
+                before = np.flatnonzero(previous_call == side)
+                if not len(current) or not len(before):
+                    continue
+                position = np.minimum(np.searchsorted(previous_strike[before], strike[current]), len(before) - 1)
+                index = before[position]
+                matched = previous_strike[index] == strike[current]
+                guess[current[matched]] = previous_iv[index[matched]]
+                if previous_context == context:
+                    same = matched & (previous_ltp[index] == ltp[current])
+                    result[current[same]] = previous_iv[index[same]]
+                    known[current[same]] = True
+                    self.reused += int(same.sum())
+
+        todo = ~known & (ltp > 0)
+        if todo.any():
+            result[todo] = implied_vol(ltp[todo], spot, strike[todo], years, is_call[todo], self.rate, carry,
+                                       guess=None if guess is None else guess[todo])
+            self.solved += int(todo.sum())
+        with self._lock:
+            self._previous[key] = (context, strike, is_call, ltp, result)
+        return result
+
+    def stats(self):
+        return {'solved': self.solved, 'reused': self.reused, 'chains': len(self._previous)}
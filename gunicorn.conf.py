@@ -0,0 +1,26 @@
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+
+# One process per core scales reads across cores. Under gthread every open
+# /api/stream connection holds one of a worker's threads, so the app caps
+# streams at GUNICORN_THREADS - 8 per worker (MAX_STREAMS_PER_WORKER) and
+# answers the rest with 503, which sends the page back to polling. For many
+# concurrent streams, install gevent and set GUNICORN_WORKER_CLASS=gevent
+# (raise MAX_STREAMS_PER_WORKER with it).
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+
+# Import the app in each worker (not in the master) so schedulers, Mongo
+# clients and thread pools are never shared across a fork.
+preload_app = False
+
+# SSE connections idle between snapshots; keep-alives go out every 15 s
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
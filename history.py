@@ -0,0 +1,217 @@
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime, time, timedelta, timezone
+
+import numpy as np
+
+# Supported ?resolution= values, in seconds
+RESOLUTIONS = {'1m': 60, '5m': 300, '15m': 900}
+
+EPOCH = datetime(1970, 1, 1)
+
+# India has no DST, so trading days are delimited with a fixed offset
+IST_OFFSET = timedelta(hours=5, minutes=30)
+
+# Per-strike series served by /api/history (a subset of storage.BUCKET_FIELDS); PCR is derived from the OI columns
+SERIES_FIELDS = ['CEOI', 'PEOI', 'CE-CH-OI', 'PE-CH-OI', 'CLTP', 'PLTP']
+
+
+def to_millis(timestamp):
+    return int(timestamp.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def ist_day_start(timestamp):
+    """IST midnight of the trading day containing `timestamp`, as a naive UTC datetime."""
+    return datetime.combine((timestamp + IST_OFFSET).date(), time()) - IST_OFFSET
+
+
+def downsample(times, columns, resolution):
+    """Keep the last sample of every `resolution`-second bucket.
+
+    `times` are UTC milliseconds in ascending order; returns (times, columns)
+    with times floored to the bucket start.
+    """
+    if len(times) == 0:
+        return [], {field: [] for field in columns}
+    buckets = np.asarray(times, dtype=np.int64) // (resolution * 1000)
+    last = np.flatnonzero(np.append(np.diff(buckets) != 0, True))
+    return (
+        (buckets[last] * resolution * 1000).tolist(),
+        {field: np.asarray(values, dtype=float)[last].tolist() for field, values in columns.items()},
+    )
+
+
+def with_pcr(series):
+    ce_oi = np.asarray(series['CEOI'], dtype=float)
+    pe_oi = np.asarray(series['PEOI'], dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pcr = np.where(ce_oi != 0, pe_oi / ce_oi, 0.0)
+    series['PCR'] = np.round(pcr, 4).tolist()
+    return series
+
+
+# Columnar intraday series per (underlying, expiry) and strike, appended as
+# snapshots are published. Only the current IST trading day is held. A day's
+# series is complete if its first snapshot was taken while this process was
+# running; otherwise (a restart mid-session) only the range from its first
+# sample is, and earlier ranges are answered from MongoDB. Only strikes in the
+# default window are sampled, so a strike that entered or left the window
+# has gaps; covers() sends those ranges to MongoDB as well.
+class IntradayHistory:
+    def __init__(self):
+        # (underlying, expiry) -> {'day_start', 'start', 'complete', 'times': [snapshot ms, ...],
+        #                          'strikes': {strike: {'t': [...], field: [...]}}}
+        self._series = {}
+        self._started = to_millis(datetime.utcnow())
+        self._lock = threading.Lock()
+
+    def append(self, document):
+        key = (document['underlying'], document['expiry'])
+        timestamp = document['timestamp']
+        millis = to_millis(timestamp)
+        day_start = to_millis(ist_day_start(timestamp))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None or series['day_start'] != day_start:
+                series = self._series[key] = {
+                    'day_start': day_start,
+                    'start': millis,
+                    'complete': millis >= self._started,
+                    'times': [],
+                    'strikes': {},
+                }
+            if series['times'] and series['times'][-1] >= millis:
+                return
+            series['times'].append(millis)
+            for row in document['data']:
+                strike = series['strikes'].setdefault(row['STP'], {'t': [], **{field: [] for field in SERIES_FIELDS}})
+                if strike['t'] and strike['t'][-1] >= millis:
+                    continue
+                strike['t'].append(millis)
+                for field in SERIES_FIELDS:
+                    strike[field].append(row.get(field) or 0)
+
+    def export(self):
+        """JSON-ready copy of the series, for IntradayHistory.restore() in a later process."""
+        with self._lock:
+            return [
+                {
+                    'underlying': underlying,
+                    'expiry': expiry,
+                    **{name: series[name] for name in ('day_start', 'start', 'complete')},
+                    'times': list(series['times']),
+                    'strikes': [[strike, {name: list(values) for name, values in columns.items()}]
+                                for strike, columns in series['strikes'].items()],
+                }
+                for (underlying, expiry), series in self._series.items()
+            ]
+
+    def restore(self, exported, saved_at, max_gap=60):
+        """Take over today's series from export(), taken at `saved_at` (naive UTC).
+
+        If more than `max_gap` seconds have passed since then, samples taken
+        meanwhile are missing, so the series only count as complete from now.
+        """
+        now = datetime.utcnow()
+        day_start = to_millis(ist_day_start(now))
+        gap = (now - saved_at).total_seconds() > max_gap
+        restored = 0
+        with self._lock:
+            for series in exported:
+                key = (series['underlying'], series['expiry'])
+                if series['day_start'] != day_start or key in self._series:
+                    continue
+                self._series[key] = {
+                    'day_start': day_start,
+                    'start': self._started if gap else series['start'],
+                    'complete': False if gap else series['complete'],
+                    # Files saved before snapshot times were kept: every time some strike was sampled at
+                    'times': series.get('times') or sorted({t for _, columns in series['strikes'] for t in columns['t']}),
+                    'strikes': {strike: columns for strike, columns in series['strikes']},
+                }
+                restored += 1
+        return restored
+
+    def covers(self, underlying, expiry, start, end, strikes=None):
+        """True if the in-memory series hold every sample between `start` and `end` (UTC ms).
+
+        That needs the series to reach back to `start`, and every requested
+        strike (every held one if `strikes` is None) to have a sample from
+        each snapshot in the range, which fails for strikes that entered or
+        left the default window meanwhile.
+        """
+        with self._lock:
+            series = self._series.get((underlying, expiry))
+            if series is None or start < series['day_start']:
+                return False
+            if not (series['complete'] or series['start'] <= start):
+                return False
+            times = series['times']
+            expected = bisect_right(times, end) - bisect_left(times, start)
+            for strike in series['strikes'] if strikes is None else strikes:
+                columns = series['strikes'].get(strike)
+                if columns is None:
+                    return False
+                held = columns['t']
+                if bisect_right(held, end) - bisect_left(held, start) != expected:
+                    return False
+            return True
+
+    def query(self, underlying, expiry, strikes, start, end, resolution):
+        with self._lock:
+            series = self._series.get((underlying, expiry))
+            if series is None:
+                return {}
+            selected = {
+                strike: {name: list(values) for name, values in columns.items()}
+                for strike, columns in series['strikes'].items()
+                if strikes is None or strike in strikes
+            }
+
+        result = {}
+        for strike, columns in sorted(selected.items()):
+            times = np.asarray(columns.pop('t'), dtype=np.int64)
+            lo = np.searchsorted(times, start, side='left')
+            hi = np.searchsorted(times, end, side='right')
+            times, values = downsample(times[lo:hi], {field: values[lo:hi] for field, values in columns.items()}, resolution)
+            if times:
+                result[strike] = with_pcr({'t': times, **values})
+        return result
+
+
+def query_buckets(bucket_collection, underlying, expiry, strikes, start, end, resolution):
+    """Downsample bucketed samples with an aggregation; `start`/`end` are naive UTC datetimes."""
+    match = {
+        'underlying': underlying,
+        'expiry': expiry,
+        'day': {'$gte': datetime(start.year, start.month, start.day), '$lte': end},
+    }
+    if strikes is not None:
+        match['strike'] = {'$in': list(strikes)}
+
+    # Buckets are floored on epoch milliseconds ($subtract/$mod rather than $dateTrunc, which needs MongoDB 5.0)
+    millis = {'$subtract': ['$samples.t', EPOCH]}
+    pipeline = [
+        {'$match': match},
+        {'$unwind': '$samples'},
+        {'$match': {'samples.t': {'$gte': start, '$lte': end}}},
+        {'$sort': {'strike': 1, 'samples.t': 1}},
+        {'$group': {
+            '_id': {
+                'strike': '$strike',
+                't': {'$subtract': [millis, {'$mod': [millis, resolution * 1000]}]},
+            },
+            **{field: {'$last': f'$samples.{field}'} for field in SERIES_FIELDS},
+        }},
+        {'$sort': {'_id.strike': 1, '_id.t': 1}},
+    ]
+
+    result = {}
+    for bucket in bucket_collection.aggregate(pipeline, allowDiskUse=True):
+        strike = bucket['_id']['strike']
+        series = result.setdefault(strike, {'t': [], **{field: [] for field in SERIES_FIELDS}})
+        series['t'].append(int(bucket['_id']['t']))
+        for field in SERIES_FIELDS:
+            series[field].append(bucket.get(field) or 0)
+    return {strike: with_pcr(series) for strike, series in result.items()}
+
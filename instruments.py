@@ -0,0 +1,35 @@
+import json
+import os
+
+# Underlyings refreshed by update_cache().
+#
+# `expiries` is either the number of upcoming expiries to follow (1 = near,
+# 2 = near + next), resolved daily from Dhan's expiry list, or an explicit
+# list of 'YYYY-MM-DD' dates. Set INSTRUMENTS_FILE to a JSON file with the
+# same structure to override this list without touching code.
+DEFAULT_INSTRUMENTS = [
+    {'name': 'NIFTY', 'security_id': 13, 'segment': 'IDX_I', 'strike_interval': 50, 'expiries': 2},
+    {'name': 'BANKNIFTY', 'security_id': 25, 'segment': 'IDX_I', 'strike_interval': 100, 'expiries': 2},
+    {'name': 'FINNIFTY', 'security_id': 27, 'segment': 'IDX_I', 'strike_interval': 50, 'expiries': 2},
+    {'name': 'RELIANCE', 'security_id': 2885, 'segment': 'NSE_EQ', 'strike_interval': 20, 'expiries': 1},
+]
+
+
+def load_instruments(path=None):
+    path = path or os.environ.get('INSTRUMENTS_FILE')
+    if not path:
+        return list(DEFAULT_INSTRUMENTS)
+    with open(path) as f:
+        return json.load(f)
+
+
+INSTRUMENTS = load_instruments()
+
+# The first registered underlying is served when a request does not name one
+DEFAULT_UNDERLYING = INSTRUMENTS[0]['name']
+
+
+def get_instrument(name):
+    """Return the registry entry for `name` (case-insensitive), or None."""
+    name = (name or '').upper()
+    return next((instrument for instrument in INSTRUMENTS if instrument['name'] == name), None)
@@ -0,0 +1,67 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+
+# Lease-based leader election through a MongoDB document.
+#
+# Every worker calls acquire_or_renew() periodically. The document
+# {_id: name, owner, expires_at} is claimed by whoever finds it expired (or
+# missing) and is renewed by its owner; the unique _id turns a lost race
+# into a DuplicateKeyError. If MongoDB cannot be reached, a leader keeps its
+# role only until its own lease would have expired, so two workers never
+# both believe they lead for longer than clock skew allows.
+class LeaderLock:
+    def __init__(self, collection, name='scheduler', ttl=30):
+        self.collection = collection
+        self.name = name
+        self.ttl = ttl
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._lease_deadline = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def is_leader(self):
+        with self._lock:
+            return time.monotonic() < self._lease_deadline
+
+    def acquire_or_renew(self):
+        now = datetime.utcnow()
+        started = time.monotonic()
+        try:
+            self.collection.find_one_and_update(
+                {'_id': self.name, '$or': [{'owner': self.owner}, {'expires_at': {'$lt': now}}]},
+                {'$set': {'owner': self.owner, 'expires_at': now + timedelta(seconds=self.ttl), 'renewed_at': now}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Another worker holds an unexpired lease
+            self._set_deadline(0.0)
+            return False
+        except PyMongoError as e:
+            logging.error("Leader lease renewal failed: %s", e)
+            return self.is_leader
+
+        if not self.is_leader:
+            logging.info("Acquired %s leadership as %s", self.name, self.owner)
+        self._set_deadline(started + self.ttl)
+        return True
+
+    def _set_deadline(self, deadline):
+        with self._lock:
+            self._lease_deadline = deadline
+
+    def release(self):
+        self._set_deadline(0.0)
+        try:
+            self.collection.delete_one({'_id': self.name, 'owner': self.owner})
+        except PyMongoError as e:
+            logging.error("Failed to release %s leadership: %s", self.name, e)
@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+from datetime import date, datetime, time, timedelta
+
+import pytz
+
+IST = pytz.timezone('Asia/Kolkata')
+
+# NSE trading holidays (equity and F&O segments). Keep in sync with the
+# exchange's annual circular, or point MARKET_HOLIDAYS_FILE at a JSON list of
+# 'YYYY-MM-DD' dates to override without a deploy.
+NSE_HOLIDAYS = {
+    # 2025
+    '2025-02-26', '2025-03-14', '2025-03-31', '2025-04-10', '2025-04-14', '2025-04-18', '2025-05-01',
+    '2025-08-15', '2025-08-27', '2025-10-02', '2025-10-21', '2025-10-22', '2025-11-05', '2025-12-25',
+    # 2026
+    '2026-01-26', '2026-03-03', '2026-03-26', '2026-03-31', '2026-04-03', '2026-04-14', '2026-05-01',
+    '2026-05-28', '2026-06-26', '2026-09-14', '2026-10-02', '2026-10-20', '2026-11-10', '2026-11-24',
+    '2026-12-25',
+}
+
+# Session phases
+CLOSED = 'closed'
+PRE_OPEN = 'pre_open'
+OPEN = 'open'
+POST_CLOSE = 'post_close'
+
+
+def load_holidays():
+    path = os.getenv('MARKET_HOLIDAYS_FILE')
+    if not path:
+        return {date.fromisoformat(day) for day in NSE_HOLIDAYS}
+    try:
+        with open(path) as f:
+            return {date.fromisoformat(day) for day in json.load(f)}
+    except (OSError, ValueError) as e:
+        logging.error("Failed to load market holidays from %s, using built-in list: %s", path, e)
+        return {date.fromisoformat(day) for day in NSE_HOLIDAYS}
+
+
+# Trading sessions in IST and the refresh cadence for each part of the day.
+#
+# Refreshes run every `open_interval` seconds during the session, every
+# `busy_interval` in the first and last half hour and on expiry-day
+# afternoons, and every `quiet_interval` over the midday lull. Outside the
+# session nothing is fetched; the scheduler sleeps until the next pre-open.
+class MarketCalendar:
+    pre_open = time(9, 0)
+    market_open = time(9, 15)
+    market_close = time(15, 30)
+    post_close_end = time(16, 0)
+
+    opening_rush_end = time(9, 45)
+    closing_rush_start = time(15, 0)
+    quiet_start = time(11, 30)
+    quiet_end = time(13, 30)
+    expiry_afternoon_start = time(13, 30)
+
+    busy_interval = 15
+    open_interval = 60
+    quiet_interval = 120
+    pre_open_interval = 60
+    max_sleep = 3600  # re-evaluate at least hourly while closed
+
+    def __init__(self, holidays=None):
+        self.holidays = load_holidays() if holidays is None else set(holidays)
+
+    @staticmethod
+    def now():
+        return datetime.now(IST)
+
+    def is_trading_day(self, day):
+        return day.weekday() < 5 and day not in self.holidays
+
+    def phase(self, now=None):
+        now = now or self.now()
+        if not self.is_trading_day(now.date()):
+            return CLOSED
+        current = now.time()
+        if self.pre_open <= current < self.market_open:
+            return PRE_OPEN
+        # The closing minute counts as open so the final prints are captured
+        if self.market_open <= current.replace(second=0, microsecond=0) <= self.market_close:
+            return OPEN
+        if self.market_close < current < self.post_close_end:
+            return POST_CLOSE
+        return CLOSED
+
+    def next_session_start(self, now=None):
+        """IST datetime of the next pre-open, today's if it is still ahead."""
+        now = now or self.now()
+        day = now.date()
+        if now.time() >= self.pre_open:
+            day += timedelta(days=1)
+        while not self.is_trading_day(day):
+            day += timedelta(days=1)
+        return IST.localize(datetime.combine(day, self.pre_open))
+
+    def refresh_interval(self, now=None, expiry_today=False):
+        """Seconds until the next refresh; None when no refresh should run in the current phase."""
+        now = now or self.now()
+        phase = self.phase(now)
+        if phase == PRE_OPEN:
+            return self.pre_open_interval
+        if phase != OPEN:
+            return None
+        current = now.time()
+        if current < self.opening_rush_end or current >= self.closing_rush_start:
+            return self.busy_interval
+        if expiry_today and current >= self.expiry_afternoon_start:
+            return self.busy_interval
+        if self.quiet_start <= current < self.quiet_end:
+            return self.quiet_interval
+        return self.open_interval
+
+    def next_run_delay(self, now=None, expiry_today=False):
+        """Seconds the refresh job should sleep before it runs again."""
+        now = now or self.now()
+        interval = self.refresh_interval(now, expiry_today)
+        if interval is not None:
+            # Never sleep across the open or the close: land on the boundary instead
+            for boundary in (self.market_open, self.market_close):
+                edge = IST.localize(datetime.combine(now.date(), boundary))
+                if now < edge < now + timedelta(seconds=interval):
+                    return max((edge - now).total_seconds() + 1, 1)
+            return interval
+        until_session = (self.next_session_start(now) - now).total_seconds()
+        return max(min(until_session, self.max_sleep), 1)
@@ -0,0 +1,213 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Minimal Prometheus instrumentation: counters, histograms and gauges rendered
+# in the text exposition format at /metrics. Values are per process; under
+# gunicorn each worker reports its own, and fetch/refresh metrics only move
+# in the scheduler leader.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return self.header() + [
+            f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+            for key, value in sorted(values.items())
+        ]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry['buckets'][i] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self._lock:
+            values = {key: {'buckets': list(entry['buckets']), 'sum': entry['sum'], 'count': entry['count']}
+                      for key, entry in self._values.items()}
+        lines = self.header()
+        for key, entry in sorted(values.items()):
+            for bound, count in zip(self.buckets, entry['buckets']):
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, [("le", _format_value(bound))])} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(entry["sum"])}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {entry["count"]}')
+        return lines
+
+
+# Values computed at scrape time from existing in-process state, e.g. cache counters
+class CallbackMetric(Metric):
+    def __init__(self, name, documentation, kind, collect, labels=()):
+        super().__init__(name, documentation, labels)
+        self.kind = kind
+        self.collect = collect  # () -> {label values tuple: value}
+
+    def render(self):
+        try:
+            values = self.collect()
+        except Exception as e:
+            logging.error("Failed to collect metric %s: %s", self.name, e)
+            values = {}
+        return self.header() + [
+            f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+            for key, value in sorted(values.items())
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+
+REGISTRY = Registry()
+
+DHAN_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'dhan_option_chain_request_seconds', 'Latency of Dhan option_chain calls.', ('underlying', 'outcome')))
+TRANSFORM_SECONDS = REGISTRY.register(Histogram(
+    'option_chain_transform_seconds', 'Time to transform one raw option chain into the columnar chain.', ('underlying',)))
+MONGO_INSERT_SECONDS = REGISTRY.register(Histogram(
+    'option_chain_store_seconds', 'Time to store one snapshot (to queue it, with write-behind).', ('underlying', 'result')))
+WRITE_BATCH_SECONDS = REGISTRY.register(Histogram(
+    'option_chain_write_batch_seconds', 'Time to write one write-behind batch to MongoDB.', ('outcome',)))
+WRITES_DROPPED = REGISTRY.register(Counter(
+    'option_chain_writes_dropped_total', 'Queued MongoDB writes dropped because the queue was full or closed.'))
+REFRESH_RETRIES = REGISTRY.register(Counter(
+    'option_chain_refresh_retries_total', 'Deferred refresh retries scheduled.', ('underlying',)))
+REFRESH_FAILURES = REGISTRY.register(Counter(
+    'option_chain_refresh_failures_total', 'Refresh attempts that failed.', ('underlying', 'reason')))
+DHAN_CLIENT_CALLS = REGISTRY.register(Counter(
+    'dhan_client_calls_total', 'Dhan client calls by how they were served (upstream, coalesced, cached).',
+    ('method', 'result')))
+STREAMS_REJECTED = REGISTRY.register(Counter(
+    'stream_rejected_total', '/api/stream requests refused with 503 because the worker was at its stream limit.'))
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'http_request_seconds', 'Latency of HTTP requests by route.', ('route', 'method', 'status')))
+
+
+# Optional sampling profiler for requests, configured through the environment:
+#   PROFILE_SAMPLE_RATE  fraction of requests to profile (default 0, disabled)
+#   PROFILE_SLOW_MS      only report profiled requests slower than this (default 250)
+#   PROFILE_DIR          write .prof files here instead of logging the top functions
+class RequestProfiler:
+    def __init__(self, sample_rate=None, slow_ms=None, output_dir=None):
+        self.sample_rate = float(os.getenv('PROFILE_SAMPLE_RATE', '0') if sample_rate is None else sample_rate)
+        self.slow_ms = float(os.getenv('PROFILE_SLOW_MS', '250') if slow_ms is None else slow_ms)
+        self.output_dir = output_dir or os.getenv('PROFILE_DIR')
+        self._lock = threading.Lock()  # cProfile allows a single active profiler per process
+
+    def start(self):
+        """Return an enabled profiler for this request, or None if it is not sampled."""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        if not self._lock.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler (e.g. an external one) is active
+            self._lock.release()
+            return None
+        return profiler
+
+    def finish(self, profiler, label, elapsed):
+        profiler.disable()
+        self._lock.release()
+        if elapsed * 1000 < self.slow_ms:
+            return
+        if self.output_dir:
+            path = os.path.join(self.output_dir, f'{label.strip("/").replace("/", "_") or "index"}-{int(time.time() * 1000)}.prof')
+            profiler.dump_stats(path)
+            logging.warning("Slow request %s took %.1f ms; profile written to %s", label, elapsed * 1000, path)
+            return
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(20)
+        logging.warning("Slow request %s took %.1f ms:\n%s", label, elapsed * 1000, output.getvalue())
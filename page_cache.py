@@ -0,0 +1,66 @@
+import os
+import threading
+import time
+
+
+# Rendered index pages, one per underlying/expiry/strike window, re-rendered only when the
+# snapshot changes. The page is rendered with a placeholder in place of the
+# CSP nonce and split around it, so a warm hit only joins the fragments
+# around a fresh nonce.
+class PageCache:
+    def __init__(self):
+        # Random per process so snapshot data can never collide with it
+        self.placeholder = f'__csp_nonce_{os.urandom(8).hex()}__'
+        self._pages = {}  # (underlying, expiry, window) -> (snapshot_id, [fragment, ...])
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._stats = {
+            'cold': 0,
+            'warm': 0,
+            'cold_seconds': 0.0,
+            'warm_seconds': 0.0,
+            'cold_max_seconds': 0.0,
+        }
+
+    def render(self, key, snapshot_id, render, nonce):
+        """Return the page for `key` at `snapshot_id` with `nonce` substituted.
+
+        `render(placeholder)` produces the full page and is only called when the
+        cached page is for an older snapshot.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            cached = self._pages.get(key)
+        if cached is not None and cached[0] == snapshot_id:
+            page = nonce.join(cached[1])
+            self._record('warm', time.perf_counter() - start)
+            return page
+
+        fragments = render(self.placeholder).split(self.placeholder)
+        with self._lock:
+            current = self._pages.get(key)
+            if current is None or current[0] <= snapshot_id:
+                self._pages[key] = (snapshot_id, fragments)
+        page = nonce.join(fragments)
+        self._record('cold', time.perf_counter() - start)
+        return page
+
+    def _record(self, kind, elapsed):
+        with self._lock:
+            self._stats[kind] += 1
+            self._stats[f'{kind}_seconds'] += elapsed
+            if kind == 'cold':
+                self._stats['cold_max_seconds'] = max(self._stats['cold_max_seconds'], elapsed)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        uptime = time.monotonic() - self._started
+        return {
+            'cold_renders': stats['cold'],
+            'warm_hits': stats['warm'],
+            'cold_avg_ms': stats['cold_seconds'] / stats['cold'] * 1000 if stats['cold'] else None,
+            'cold_max_ms': stats['cold_max_seconds'] * 1000,
+            'warm_avg_ms': stats['warm_seconds'] / stats['warm'] * 1000 if stats['warm'] else None,
+            'requests_per_second': (stats['cold'] + stats['warm']) / uptime if uptime else 0.0,
+        }
@@ -0,0 +1,127 @@
+import gzip
+import json
+from datetime import datetime, timezone
+
+from werkzeug.http import http_date
+
+from columnar import rows_to_columns
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:  # ?format=msgpack is only offered when msgpack is installed
+    msgpack = None
+
+# ?format= values for /api/data and their content types; 'json' is the row format
+FORMATS = {'json': 'application/json', 'columnar': 'application/json'}
+if msgpack is not None:
+    FORMATS['msgpack'] = 'application/x-msgpack'
+
+
+def _json_default(value):
+    # Match Flask's jsonify, which renders datetimes as HTTP dates
+    if isinstance(value, datetime):
+        return http_date(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    return json.dumps(obj, default=_json_default, separators=(',', ':')).encode('utf-8')
+
+
+def snapshot_id(timestamp):
+    """Snapshot identifier: UTC milliseconds, the precision MongoDB stores timestamps with."""
+    return int(timestamp.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def snapshot_etag(timestamp):
+    """Strong ETag derived from the snapshot timestamp."""
+    return f'"{snapshot_id(timestamp)}"'
+
+
+# Content encodings bodies are pre-compressed with, in order of preference; each tags the ETag as a suffix
+ENCODINGS = ('br', 'gzip')
+
+
+def _compress(body):
+    encodings = {'gzip': gzip.compress(body, compresslevel=6)}
+    if brotli is not None:
+        encodings['br'] = brotli.compress(body, quality=5)
+    return encodings
+
+
+# /api/data body for one snapshot, serialized and compressed once when the
+# snapshot is published. The row format (`body`) is built eagerly; the
+# columnar and msgpack formats on first request. Payloads for a non-default
+# strike `window` carry it in their ETag (`-w{window}`), as the body of every
+# other window size is different: matches() compares that tag exactly, so a
+# validator from one window never revalidates another.
+class SnapshotPayload:
+    def __init__(self, document, window=None):
+        self.document = document
+        self.snapshot_id = snapshot_id(document['timestamp'])
+        self.etag = snapshot_etag(document['timestamp'])
+        if window is not None:
+            self.etag = f'{self.etag[:-1]}-w{window}"'
+        self.body = dumps({
+            'snapshot_id': self.snapshot_id,
+            'data': document['data'],
+            'atm_strike': document['atm_strike'],
+            'timestamp': document['timestamp'],
+        })
+        self.encodings = _compress(self.body)
+        self._formats = {'json': (self.body, self.encodings)}
+
+    def _columnar(self):
+        document = self.document
+        return {
+            'snapshot_id': self.snapshot_id,
+            **rows_to_columns(document['data']),
+            'atm_strike': document['atm_strike'],
+            'timestamp': document['timestamp'],
+        }
+
+    def representation(self, fmt='json'):
+        """(body, {encoding: compressed body}) for `fmt`, one of FORMATS."""
+        cached = self._formats.get(fmt)
+        if cached is not None:
+            return cached
+        if fmt == 'columnar':
+            body = dumps(self._columnar())
+        elif fmt == 'msgpack' and msgpack is not None:
+            body = msgpack.packb(self._columnar(), default=_json_default)
+        else:
+            raise ValueError(f'Unknown payload format: {fmt}')
+        # Concurrent first requests may both build it; the results are identical
+        self._formats[fmt] = (body, _compress(body))
+        return self._formats[fmt]
+
+    def negotiate(self, accept_encodings, fmt='json'):
+        """Pick the best pre-compressed body of `fmt` for a request's Accept-Encoding header.
+
+        Returns (content_encoding, body, etag); content_encoding is None for identity.
+        """
+        body, encodings = self.representation(fmt)
+        etag = self.format_etag(fmt)
+        for encoding in ENCODINGS:
+            if encoding in encodings and accept_encodings[encoding]:
+                return encoding, encodings[encoding], f'{etag[:-1]}-{encoding}"'
+        return None, body, etag
+
+    def format_etag(self, fmt='json'):
+        """ETag of the identity body of `fmt`; each format (and window) gets its own strong validator."""
+        return self.etag if fmt == 'json' else f'{self.etag[:-1]}-{fmt}"'
+
+    def matches(self, if_none_match, fmt='json'):
+        """True if an If-None-Match header names this payload's `fmt` body, in any content encoding."""
+        if not if_none_match:
+            return False
+        if if_none_match.star_tag:
+            return True
+        base = self.format_etag(fmt).strip('"')
+        accepted = {base} | {f'{base}-{encoding}' for encoding in ENCODINGS}
+        return not accepted.isdisjoint(if_none_match.as_set(include_weak=True))
@@ -0,0 +1,101 @@
+import random
+import threading
+import time
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an API whose circuit breaker is open."""
+
+
+def retry_delay(attempt, base_delay=5, max_delay=30):
+    """Exponential backoff with jitter: half the backoff is fixed, the other half random."""
+    backoff = min(max_delay, base_delay * (2 ** attempt))
+    return backoff / 2 + random.uniform(0, backoff / 2)
+
+
+# Stops calling a failing API after `failure_threshold` consecutive failures.
+# After `reset_timeout` seconds a single trial call is let through (half-open);
+# its outcome closes the breaker again or re-opens it for another timeout.
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+# Attempt counters and latencies per key, exported through /api/stats
+class AttemptStats:
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, key):
+        return self._stats.setdefault(key, {
+            'attempts': 0,
+            'successes': 0,
+            'failures': 0,
+            'retries': 0,
+            'skipped': 0,
+            'last_latency': None,
+            'max_latency': 0.0,
+            'total_latency': 0.0,
+        })
+
+    def record_attempt(self, key, latency, success):
+        with self._lock:
+            entry = self._entry(key)
+            entry['attempts'] += 1
+            entry['successes' if success else 'failures'] += 1
+            entry['last_latency'] = latency
+            entry['max_latency'] = max(entry['max_latency'], latency)
+            entry['total_latency'] += latency
+
+    def record_retry(self, key):
+        with self._lock:
+            self._entry(key)['retries'] += 1
+
+    def record_skip(self, key):
+        with self._lock:
+            self._entry(key)['skipped'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {key: dict(entry) for key, entry in self._stats.items()}
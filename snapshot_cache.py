@@ -0,0 +1,423 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from columnar import expand, with_window
+from delta import build_patch
+from payload import SnapshotPayload, dumps
+from resilience import retry_delay
+
+# Change stream errors: not a replica set, and resume token no longer in the oplog
+CHANGE_STREAM_UNSUPPORTED_CODE = 40573
+CHANGE_STREAM_HISTORY_LOST_CODES = (260, 280, 286)
+UNSUPPORTED_RETRY_SECONDS = 300
+
+# Seconds a lookup that found nothing in MongoDB is remembered, and how many such misses are kept
+MISS_TTL_SECONDS = 30
+MAX_MISSES = 1024
+
+
+# Process-local holder for the latest option chain snapshot of one
+# underlying/expiry (the documents matching `query`).
+#
+# update_cache() publishes every document it inserts, so routes can serve
+# from memory. Documents inserted by other workers are picked up through a
+# MongoDB change stream when the deployment supports one (replica sets, see
+# SnapshotRegistry.watch), otherwise through a cheap timestamp-only probe
+# that runs at most once per `check_interval` seconds. Each snapshot's /api/data payload is serialized
+# once, when the snapshot is published; payloads for other strike windows are
+# sliced from the snapshot's full chain on first request and kept until the
+# next snapshot. A short ring of recent snapshots is kept so clients can be
+# sent patches instead of full payloads.
+#
+# A snapshot restored from local state (see warm_start.py) is pinned: it is
+# served without any MongoDB checks until load() reaches MongoDB once. A
+# snapshot this process published itself is not checked either while
+# `authoritative()` says no other process writes (this one is the leader).
+# A failed check counts as a check, so a MongoDB outage costs at most one
+# short-timeout probe per `check_interval`.
+class SnapshotCache:
+    def __init__(self, collection, query=None, check_interval=5, ring_size=10, listeners=None, authoritative=None):
+        self.collection = collection
+        self.query = query or {}
+        self.check_interval = check_interval
+        self.authoritative = authoritative
+        self.watching = False
+        self.pinned = False
+        self.checked_at = None
+        self.hits = 0
+        self.misses = 0
+        self._snapshot = None
+        self._payload = None
+        self._local = False  # the current snapshot was published by this process
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        self._listeners = listeners if listeners is not None else []
+        self._ring = deque(maxlen=ring_size)
+        self._patches = {}  # (since, window) -> serialized patch
+        self._windows = {}  # window -> SnapshotPayload
+
+    def add_listener(self, callback):
+        """Call `callback(document, payload, previous)` whenever a newer snapshot is published."""
+        self._listeners.append(callback)
+
+    def publish(self, document, local=False):
+        """Replace the cached snapshot if `document` is newer than the current one; `local` if this process made it."""
+        current = self._snapshot
+        if current is not None and document['timestamp'] <= current['timestamp']:
+            return False
+        payload = SnapshotPayload(document)
+        with self._lock:
+            current = self._snapshot
+            if current is not None and document['timestamp'] <= current['timestamp']:
+                return False
+            previous = self._snapshot
+            self._snapshot = document
+            self._local = local
+            self._payload = payload
+            self._ring.append((payload.snapshot_id, document))
+            self._patches = {}
+            self._windows = {}
+            self._last_check = time.monotonic()
+        for callback in self._listeners:
+            try:
+                callback(document, payload, previous)
+            except Exception as e:
+                logging.error("Snapshot listener failed: %s", e)
+        return True
+
+    def restore(self, document):
+        """Publish a locally saved snapshot and serve it without checking MongoDB until load() succeeds."""
+        self.pinned = True
+        return self.publish(document)
+
+    def load(self):
+        """Publish the latest stored snapshot if it is newer and stop pinning; False if MongoDB is unavailable."""
+        try:
+            latest = self.collection.find_one(self.query, sort=[('timestamp', -1)])
+        except PyMongoError as e:
+            logging.warning("Snapshot cache could not load from MongoDB yet: %s", e)
+            return False
+        if latest is not None:
+            self.publish(expand(latest))
+        with self._lock:
+            self.pinned = False
+            self._last_check = time.monotonic()
+        return True
+
+    def latest(self):
+        """The current snapshot, without any MongoDB check."""
+        return self._snapshot
+
+    def touch(self, checked_at):
+        """Record that the source was checked at `checked_at` and had not changed."""
+        with self._lock:
+            if self.checked_at is None or checked_at > self.checked_at:
+                self.checked_at = checked_at
+
+    def get(self):
+        """Return the latest snapshot, refreshing from MongoDB only when needed."""
+        authoritative = self._local and self.authoritative is not None and self.authoritative()
+        with self._lock:
+            snapshot = self._snapshot
+            fresh = (self.pinned or self.watching or (authoritative and self._local)
+                     or (time.monotonic() - self._last_check) < self.check_interval)
+            if snapshot is not None and fresh:
+                self.hits += 1
+                return snapshot
+            self.misses += 1
+            if snapshot is not None:
+                # Claim this check, so concurrent requests keep serving the snapshot instead of probing too
+                self._last_check = time.monotonic()
+        return self._refresh(snapshot)
+
+    def get_payload(self, window=None):
+        """Return the pre-serialized payload for the latest snapshot, or None.
+
+        `window` selects that many strikes either side of ATM instead of the
+        snapshot's default window.
+        """
+        snapshot = self.get()
+        if snapshot is None:
+            return None
+        return self.payload_for(snapshot, window)
+
+    def payload_for(self, snapshot, window=None):
+        """Payload of `snapshot` for `window`, memoized while `snapshot` is current."""
+        window = self._window(snapshot, window)
+        with self._lock:
+            if self._snapshot is snapshot:
+                payload = self._payload if window is None else self._windows.get(window)
+                if payload is not None:
+                    return payload
+        if window is None:
+            return SnapshotPayload(snapshot)
+        payload = SnapshotPayload(with_window(snapshot, window), window)
+        with self._lock:
+            if self._snapshot is snapshot:
+                payload = self._windows.setdefault(window, payload)
+        return payload
+
+    def get_patch(self, since, window=None):
+        """Serialized patch from snapshot `since` to the latest one.
+
+        Returns None when `since` has left the ring (the client needs the full payload).
+        """
+        snapshot = self.get()
+        if snapshot is None:
+            return None
+        return self.patch_for(snapshot, since, window)
+
+    def patch_for(self, snapshot, since, window=None):
+        """Serialized patch from snapshot `since` to `snapshot`, memoized while `snapshot` is current."""
+        window = self._window(snapshot, window)
+        with self._lock:
+            if self._snapshot is not snapshot:
+                return None
+            patch = self._patches.get((since, window))
+            if patch is not None:
+                return patch
+            latest_id = self._payload.snapshot_id
+            base = next((document for snapshot_id, document in self._ring if snapshot_id == since), None)
+        if base is None or base is snapshot:
+            return None
+        if window is not None:
+            base, snapshot = with_window(base, window), with_window(snapshot, window)
+        patch = dumps(build_patch(base, snapshot, since, latest_id))
+        with self._lock:
+            if self._payload.snapshot_id == latest_id:
+                self._patches[(since, window)] = patch
+        return patch
+
+    @staticmethod
+    def _window(snapshot, window):
+        # None stands for the window the snapshot was published with
+        return None if window is None or window == snapshot.get('window') else window
+
+    def _refresh(self, snapshot):
+        try:
+            if snapshot is not None:
+                # Only pull the full document when someone inserted a newer one
+                marker = self.collection.find_one(
+                    self.query, projection={'timestamp': 1}, sort=[('timestamp', -1)]
+                )
+                if marker is None or marker['timestamp'] <= snapshot['timestamp']:
+                    with self._lock:
+                        self._last_check = time.monotonic()
+                    return snapshot
+            latest = self.collection.find_one(self.query, sort=[('timestamp', -1)])
+        except PyMongoError as e:
+            logging.error("Failed to refresh snapshot cache from MongoDB: %s", e)
+            with self._lock:
+                self._last_check = time.monotonic()
+            return snapshot
+
+        if latest is None:
+            return snapshot
+        self.publish(expand(latest))
+        with self._lock:
+            self._last_check = time.monotonic()
+            return self._snapshot
+
+    def stats(self):
+        with self._lock:
+            snapshot = self._snapshot
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'watching': self.watching,
+                'pinned': self.pinned,
+                'timestamp': snapshot['timestamp'] if snapshot is not None else None,
+                'checked_at': self.checked_at,
+            }
+
+
+# SnapshotCaches for every (underlying, expiry) pair, created on first use.
+# Listeners registered here apply to every cache, and a single change
+# stream routes other workers' inserts to the matching cache.
+#
+# Lookups of unknown pairs (and underlyings without an upcoming expiry) that
+# found nothing in MongoDB are remembered for `miss_ttl` seconds, so repeated
+# requests for them don't each cost a query. A snapshot of the pair arriving
+# meanwhile clears the miss.
+class SnapshotRegistry:
+    def __init__(self, collection, authoritative=None, miss_ttl=MISS_TTL_SECONDS, **cache_options):
+        self.collection = collection
+        self.authoritative = authoritative
+        self.miss_ttl = miss_ttl
+        self.cache_options = cache_options
+        self.watching = False
+        self._caches = {}
+        self._misses = {}  # (underlying, expiry) or (underlying, None, today) -> monotonic deadline
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def cache(self, underlying, expiry):
+        key = (underlying, expiry)
+        with self._lock:
+            cache = self._caches.get(key)
+            if cache is None:
+                cache = SnapshotCache(
+                    self.collection,
+                    query={'underlying': underlying, 'expiry': expiry},
+                    listeners=self._listeners,
+                    authoritative=self.authoritative,
+                    **self.cache_options
+                )
+                cache.watching = self.watching
+                self._caches[key] = cache
+                self._misses = {miss: deadline for miss, deadline in self._misses.items() if miss[0] != underlying}
+            return cache
+
+    def add_listener(self, callback):
+        """Call `callback(document, payload, previous)` for newer snapshots of any key."""
+        self._listeners.append(callback)
+
+    def publish(self, document, local=False):
+        return self.cache(document['underlying'], document['expiry']).publish(document, local)
+
+    def restore(self, document):
+        return self.cache(document['underlying'], document['expiry']).restore(document)
+
+    def load(self):
+        """Load every pinned cache from MongoDB; True once none is left pinned."""
+        with self._lock:
+            caches = [cache for cache in self._caches.values() if cache.pinned]
+        return all([cache.load() for cache in caches])
+
+    def snapshots(self):
+        """The current snapshot of every cache that has one."""
+        with self._lock:
+            caches = list(self._caches.values())
+        return [snapshot for snapshot in (cache.latest() for cache in caches) if snapshot is not None]
+
+    def expiries(self, underlying):
+        """Expiries with a snapshot in this process for `underlying`, nearest first."""
+        with self._lock:
+            caches = [(expiry, cache) for (name, expiry), cache in self._caches.items() if name == underlying]
+        return sorted(expiry for expiry, cache in caches if cache.latest() is not None)
+
+    def find(self, underlying, expiry):
+        """Cache for a requested pair, or None if no snapshot of it exists here or in MongoDB.
+
+        Unlike cache(), lookups for unknown pairs create nothing, so clients
+        cannot fill the registry with empty caches.
+        """
+        with self._lock:
+            cache = self._caches.get((underlying, expiry))
+        if cache is not None or self._missed((underlying, expiry)):
+            return cache
+        try:
+            stored = self.collection.find_one({'underlying': underlying, 'expiry': expiry}, projection={'_id': 1})
+        except PyMongoError as e:
+            logging.error("Failed to look up snapshots for %s %s: %s", underlying, expiry, e)
+            return None
+        if stored is None:
+            self._record_miss((underlying, expiry))
+            return None
+        return self.cache(underlying, expiry)
+
+    def default_expiry(self, underlying, today):
+        """Nearest expiry on or after `today` (an ISO date string) for `underlying`."""
+        upcoming = [expiry for expiry in self.expiries(underlying) if expiry >= today]
+        if upcoming:
+            return upcoming[0]
+        if self._missed((underlying, None, today)):
+            return None
+        try:
+            marker = self.collection.find_one(
+                {'underlying': underlying, 'expiry': {'$gte': today}},
+                projection={'expiry': 1},
+                sort=[('expiry', 1)],
+            )
+        except PyMongoError as e:
+            logging.error("Failed to look up default expiry for %s: %s", underlying, e)
+            return None
+        if marker is None:
+            self._record_miss((underlying, None, today))
+            return None
+        return marker['expiry']
+
+    def _missed(self, key):
+        with self._lock:
+            deadline = self._misses.get(key)
+        return deadline is not None and deadline > time.monotonic()
+
+    def _record_miss(self, key):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._misses) >= MAX_MISSES:
+                self._misses = {miss: deadline for miss, deadline in self._misses.items() if deadline > now}
+            if len(self._misses) < MAX_MISSES:
+                self._misses[key] = now + self.miss_ttl
+
+    def _set_watching(self, watching):
+        with self._lock:
+            self.watching = watching
+            for cache in self._caches.values():
+                cache.watching = watching
+
+    def watch(self):
+        """Follow inserts from other workers through a change stream, if available."""
+        thread = threading.Thread(target=self._watch_inserts, name='snapshot-cache-watch', daemon=True)
+        thread.start()
+        return thread
+
+    def _watch_inserts(self):
+        # Reopened with backoff after any error; a resume token replays inserts missed meanwhile
+        pipeline = [{'$match': {'operationType': 'insert'}}]
+        resume_token = None
+        attempt = 0
+        while True:
+            try:
+                with self.collection.watch(pipeline, resume_after=resume_token) as stream:
+                    if resume_token is None:
+                        # Nothing to replay from; catch up on whatever was inserted before the stream opened
+                        self._load_all()
+                    self._set_watching(True)
+                    logging.info("Snapshot cache is following MongoDB change stream")
+                    attempt = 0
+                    try:
+                        for change in stream:
+                            document = change['fullDocument']
+                            if 'underlying' in document and 'expiry' in document:
+                                self.publish(expand(document))
+                    finally:
+                        resume_token = stream.resume_token or resume_token
+                delay = retry_delay(0, 1)
+            except OperationFailure as e:
+                if e.code in CHANGE_STREAM_HISTORY_LOST_CODES:
+                    resume_token = None
+                    delay = retry_delay(0, 1)
+                elif e.code == CHANGE_STREAM_UNSUPPORTED_CODE:
+                    # Standalone mongod has no change streams; use timestamp probes and check again later
+                    logging.info("Change stream unavailable, using timestamp checks: %s", e)
+                    delay = UNSUPPORTED_RETRY_SECONDS
+                else:
+                    logging.warning("Change stream failed, using timestamp checks meanwhile: %s", e)
+                    delay = retry_delay(attempt, 1)
+                    attempt += 1
+            except Exception as e:
+                logging.warning("Change stream failed, using timestamp checks meanwhile: %s", e)
+                delay = retry_delay(attempt, 1)
+                attempt += 1
+            finally:
+                self._set_watching(False)
+            time.sleep(delay)
+
+    def _load_all(self):
+        with self._lock:
+            caches = list(self._caches.values())
+        for cache in caches:
+            cache.load()
+
+    def stats(self):
+        with self._lock:
+            caches = dict(self._caches)
+        return {
+            'watching': self.watching,
+            'snapshots': {f'{underlying}:{expiry}': cache.stats() for (underlying, expiry), cache in caches.items()},
+        }
@@ -0,0 +1,224 @@
+import hashlib
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import OperationFailure, PyMongoError
+
+from columnar import compact, expand, rows_to_columns
+from write_behind import WriteBehindQueue
+
+# Fields kept per strike in the daily bucket documents
+BUCKET_FIELDS = ['CLTP', 'PLTP', 'CEOI', 'PEOI', 'CE-CH-OI', 'PE-CH-OI', 'CE Volume', 'PE Volume']
+
+# MongoDB error codes for an index that exists with different options
+INDEX_CONFLICT_CODES = (85, 86)
+
+
+def content_hash(document):
+    """SHA-256 over the market data of a snapshot (full chain, or rows, and ATM strike), ignoring timestamps and ids."""
+    canonical = json.dumps(
+        {'atm_strike': document['atm_strike'], 'data': document.get('chain') or document['data']},
+        sort_keys=True, separators=(',', ':'), default=str,
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+# Storage layout for option chain snapshots.
+#
+# Snapshots stay in a regular collection (time-series collections do not
+# support the change streams SnapshotRegistry follows), indexed by
+# underlying/expiry/timestamp so reading the latest snapshot of a pair is a
+# single index seek however much history exists. Full snapshots expire after
+# `snapshot_ttl_days`; when bucketing is enabled every tick is also appended
+# to one document per (underlying, expiry, day, strike) holding compact
+# samples, which are kept for `bucket_ttl_days`. Old intraday data is thereby
+# downsampled to per-strike series instead of full rows.
+#
+# Each snapshot carries a content hash; a snapshot identical to the latest
+# one of its pair is not written again, only the latest document's
+# `checked_at` is bumped. Snapshots are written in the columnar layout (see
+# columnar.py) unless `columnar` is False.
+#
+# With `write_behind`, insert() only decides what to write and queues it
+# (see write_behind.py); the caller publishes the snapshot right away and
+# MongoDB catches up in the background.
+class SnapshotStore:
+    def __init__(self, collection, bucket_collection=None, snapshot_ttl_days=None, bucket_ttl_days=None, columnar=True,
+                 write_behind=False, max_pending=500):
+        self.collection = collection
+        self.columnar = columnar
+        self.bucket_collection = bucket_collection
+        self.snapshot_ttl_days = snapshot_ttl_days
+        self.bucket_ttl_days = bucket_ttl_days
+        self.writer = WriteBehindQueue(collection, bucket_collection, max_pending,
+                                       on_drop=self._forget) if write_behind else None
+        self._latest = {}  # (underlying, expiry) -> (content_hash, _id) of the latest stored snapshot
+        self._lock = threading.Lock()
+
+    def ensure_indexes(self):
+        self.collection.create_index(
+            [('underlying', ASCENDING), ('expiry', ASCENDING), ('timestamp', DESCENDING)],
+            name='underlying_expiry_timestamp',
+        )
+        self._ensure_ttl_index(self.collection, 'timestamp', self.snapshot_ttl_days)
+
+        if self.bucket_collection is not None:
+            self.bucket_collection.create_index(
+                [('underlying', ASCENDING), ('expiry', ASCENDING), ('day', ASCENDING), ('strike', ASCENDING)],
+                name='underlying_expiry_day_strike',
+                unique=True,
+            )
+            self._ensure_ttl_index(self.bucket_collection, 'day', self.bucket_ttl_days)
+
+    def _ensure_ttl_index(self, collection, field, ttl_days):
+        options = {'expireAfterSeconds': int(ttl_days * 86400)} if ttl_days else {}
+        try:
+            collection.create_index([(field, DESCENDING)], name=f'{field}_desc', **options)
+        except OperationFailure as e:
+            if e.code not in INDEX_CONFLICT_CODES:
+                raise
+            if ttl_days:
+                # The index exists with another (or no) expiry; change it in place
+                collection.database.command(
+                    'collMod', collection.name,
+                    index={'keyPattern': {field: -1}, 'expireAfterSeconds': options['expireAfterSeconds']},
+                )
+            else:
+                # Expiry turned off: collMod cannot remove it, so rebuild the index without one
+                logging.warning("Removing the expiry from %s.%s_desc; documents are kept from now on",
+                                collection.name, field)
+                collection.drop_index(f'{field}_desc')
+                collection.create_index([(field, DESCENDING)], name=f'{field}_desc')
+
+    def _latest_marker(self, key):
+        with self._lock:
+            marker = self._latest.get(key)
+        if marker is not None:
+            return marker
+        # First write for this pair in this process; pick up where the last writer stopped
+        try:
+            latest = self.collection.find_one(
+                {'underlying': key[0], 'expiry': key[1]},
+                projection={'content_hash': 1},
+                sort=[('timestamp', DESCENDING)],
+            )
+        except PyMongoError as e:
+            # Without the marker the snapshot is simply written again
+            logging.error("Failed to read the latest content hash for %s %s: %s", key[0], key[1], e)
+            return None
+        if latest is None or 'content_hash' not in latest:
+            return None
+        return latest['content_hash'], latest['_id']
+
+    def insert(self, document):
+        """Store one snapshot, plus its per-strike samples when bucketing is enabled.
+
+        Returns False (and only bumps `checked_at`) when the snapshot's content
+        matches the latest stored snapshot of its underlying/expiry.
+        """
+        key = (document['underlying'], document['expiry'])
+        document['content_hash'] = content_hash(document)
+        marker = self._latest_marker(key)
+        if marker is not None and marker[0] == document['content_hash']:
+            if self.writer is not None:
+                self.writer.touch(marker[1], document['timestamp'])
+            else:
+                self.collection.update_one({'_id': marker[1]}, {'$set': {'checked_at': document['timestamp']}})
+            with self._lock:
+                self._latest[key] = marker
+            return False
+
+        stored = compact(document) if self.columnar else document
+        stored['_id'] = document['_id'] = ObjectId()
+        if self.writer is not None:
+            # Recorded before the write lands, so the next tick is compared with the queued snapshot;
+            # _forget() takes it back if the write is dropped
+            with self._lock:
+                self._latest[key] = (document['content_hash'], document['_id'])
+            self.writer.insert(stored, self.bucket_samples(document) if self.bucket_collection is not None else ())
+            return True
+
+        self.collection.insert_one(stored)
+        with self._lock:
+            self._latest[key] = (document['content_hash'], document['_id'])
+        if self.bucket_collection is not None:
+            try:
+                self.append_samples(document)
+            except PyMongoError as e:
+                # The full snapshot is already stored; bucket samples are best-effort
+                logging.error("Failed to append bucket samples: %s", e)
+        return True
+
+    def _forget(self, stored):
+        # A queued snapshot was dropped unwritten; later identical snapshots must be written, not touched
+        key = (stored['underlying'], stored['expiry'])
+        with self._lock:
+            marker = self._latest.get(key)
+            if marker is not None and marker[1] == stored['_id']:
+                del self._latest[key]
+
+    def bucket_samples(self, document):
+        """(bucket filter, sample) for every strike of a snapshot's full chain (its rows when it has none)."""
+        timestamp = document['timestamp']
+        day = datetime(timestamp.year, timestamp.month, timestamp.day)
+        chain = document.get('chain') or rows_to_columns(document['data'])
+        fields = chain['fields']
+        samples = []
+        for i, strike in enumerate(chain['strikes']):
+            sample = {'t': timestamp}
+            sample.update((field, fields[field][i]) for field in BUCKET_FIELDS)
+            samples.append(({
+                'underlying': document['underlying'],
+                'expiry': document['expiry'],
+                'day': day,
+                'strike': strike,
+            }, sample))
+        return samples
+
+    def append_samples(self, document):
+        requests = [
+            UpdateOne(bucket, {'$push': {'samples': sample}, '$inc': {'count': 1}}, upsert=True)
+            for bucket, sample in self.bucket_samples(document)
+        ]
+        if requests:
+            self.bucket_collection.bulk_write(requests, ordered=False)
+
+    def flush(self, timeout=None):
+        """Wait for queued writes to reach MongoDB; True when nothing is left (or nothing is queued)."""
+        return self.writer.flush(timeout) if self.writer is not None else True
+
+    def close(self, timeout=10):
+        if self.writer is not None:
+            self.writer.close(timeout)
+
+    def latest(self, underlying, expiry):
+        return expand(self.collection.find_one(
+            {'underlying': underlying, 'expiry': expiry},
+            sort=[('timestamp', DESCENDING)],
+        ))
+
+    def samples(self, underlying, expiry, strike, start, end):
+        """Bucketed samples for one strike between `start` and `end` (naive UTC datetimes)."""
+        if self.bucket_collection is None:
+            return []
+        day_start = datetime(start.year, start.month, start.day)
+        cursor = self.bucket_collection.find(
+            {
+                'underlying': underlying,
+                'expiry': expiry,
+                'strike': strike,
+                'day': {'$gte': day_start, '$lt': end + timedelta(days=1)},
+            },
+            projection={'samples': 1},
+            sort=[('day', ASCENDING)],
+        )
+        return [
+            sample
+            for bucket in cursor
+            for sample in bucket['samples']
+            if start <= sample['t'] <= end
+        ]
@@ -0,0 +1,61 @@
+import sys
+import time
+
+import update_to_a_record
+import update_to_cname_record
+import upload
+
+# Market open/close switchover in one process, so the Mongo, S3 and HTTP
+# clients are set up once and each step is timed.
+#
+#   python switchover.py open   # DNS -> this EC2 instance (live app)
+#   python switchover.py close  # publish the static site, then DNS -> S3
+#
+# On close the static snapshot is uploaded before DNS moves, so S3 never
+# serves an empty or stale page. DNS and SSL writes are skipped when the zone
+# is already in the target state.
+
+def timed(steps, label, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    steps.append((label, time.perf_counter() - start))
+    return result
+
+def open_market(steps):
+    zone = update_to_a_record.get_zone()
+    public_ip = timed(steps, "resolve public IP", update_to_a_record.get_ec2_public_ip)
+    timed(steps, "A record", update_to_a_record.update_to_a_record, public_ip, zone)
+    timed(steps, "SSL mode", update_to_a_record.set_ssl_encryption_mode, zone)
+
+def close_market(steps):
+    data = timed(steps, "fetch latest snapshot", upload.fetch_latest_data)
+    if not data:
+        raise Exception("No data available in MongoDB; not switching DNS to an empty site")
+    uploaded, skipped = timed(steps, "publish static site", upload.publish, data)
+    print(f"Uploaded {len(uploaded)} object(s), skipped {len(skipped)} unchanged.")
+
+    zone = update_to_cname_record.get_zone()
+    timed(steps, "CNAME record", update_to_cname_record.update_to_cname_record, zone)
+    timed(steps, "SSL mode", update_to_cname_record.set_ssl_to_flexible, zone)
+
+def main(argv):
+    actions = {"open": open_market, "close": close_market}
+    if len(argv) != 2 or argv[1] not in actions:
+        print(f"Usage: {argv[0]} open|close")
+        return 2
+
+    steps = []
+    start = time.perf_counter()
+    try:
+        actions[argv[1]](steps)
+        status = 0
+    except Exception as e:
+        print(f"Error: {e}")
+        status = 1
+    for label, elapsed in steps:
+        print(f"  {label:<24} {elapsed * 1000:8.1f} ms")
+    print(f"Switchover '{argv[1]}' {'finished' if status == 0 else 'failed'} in {(time.perf_counter() - start) * 1000:.1f} ms")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+LAKH = 100000
+
+# Raw Dhan option leg fields -> normalized column names. The Greeks are
+# nested under 'greeks'; Dhan leaves them (and the IV) at zero for some
+# strikes, which greeks.GreeksEngine can fill in.
+LEG_FIELDS = {
+    'last_price': 'ltp',
+    'oi': 'oi',
+    'previous_oi': 'previous_oi',
+    'volume': 'volume',
+    'top_bid_price': 'bid',
+    'top_ask_price': 'ask',
+    'implied_volatility': 'iv',
+}
+GREEK_FIELDS = {
+    'delta': 'delta',
+    'gamma': 'gamma',
+    'theta': 'theta',
+    'vega': 'vega',
+}
+
+# Display row keys, in the order update_cache() has always stored them; theta and vega came later
+ROW_COLUMNS = [
+    'STP', 'CLTP', 'CEOI', 'CE-CH-OI', 'CE-IV', 'CE-Delta', 'CE-Gamma', 'CE-Sp',
+    'PLTP', 'PEOI', 'PE-CH-OI', 'PE-IV', 'PE-Delta', 'PE-Gamma', 'PE-Sp',
+    'PEOI - CEOI', 'Trending OI', 'CE Volume', 'PE Volume', 'Total Volume Difference',
+    'CE-Theta', 'CE-Vega', 'PE-Theta', 'PE-Vega',
+]
+
+
+def _column(values):
+    # Missing or null quotes count as zero, as the per-row .get(..., 0) calls did
+    column = np.asarray([0 if value is None else value for value in values])
+    if column.dtype.kind not in 'biuf':
+        column = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').fillna(0).to_numpy()
+    return column
+
+
+def _normalize_legs(legs, prefix, columns):
+    legs = [leg or {} for leg in legs]
+    greeks = [leg.get('greeks') or {} for leg in legs]
+    for field, name in LEG_FIELDS.items():
+        columns[prefix + name] = _column([leg.get(field) for leg in legs])
+    for field, name in GREEK_FIELDS.items():
+        columns[prefix + name] = _column([greek.get(field) for greek in greeks])
+
+
+def normalize_chain(option_chain):
+    """Flatten Dhan's {strike: {'ce': {...}, 'pe': {...}}} mapping into one columnar frame sorted by strike."""
+    strikes = np.fromiter((float(strike) for strike in option_chain), dtype=float, count=len(option_chain))
+    legs = list(option_chain.values())
+    columns = {'strike': strikes}
+    _normalize_legs([leg.get('ce') for leg in legs], 'ce_', columns)
+    _normalize_legs([leg.get('pe') for leg in legs], 'pe_', columns)
+    order = np.argsort(strikes, kind='stable')
+    return pd.DataFrame({name: column[order] for name, column in columns.items()})
+
+
+def _spread_pct(ask, bid):
+    # Spread as a percentage of mid; an empty book counts as a mid of 1
+    mid = (ask + bid) / 2
+    mid = np.where(mid != 0, mid, 1.0)
+    return (ask - bid) / mid * 100
+
+
+def derive_columns(frame):
+    """Compute the display columns for every strike of a normalized chain at once."""
+    ce_oi = frame['ce_oi'].to_numpy() / LAKH
+    pe_oi = frame['pe_oi'].to_numpy() / LAKH
+    ce_change = ce_oi - frame['ce_previous_oi'].to_numpy() / LAKH
+    pe_change = pe_oi - frame['pe_previous_oi'].to_numpy() / LAKH
+    ce_volume = frame['ce_volume'].to_numpy()
+    pe_volume = frame['pe_volume'].to_numpy()
+
+    return pd.DataFrame({
+        'STP': frame['strike'].to_numpy(),
+        'CLTP': frame['ce_ltp'].to_numpy(),
+        'CEOI': ce_oi,
+        'CE-CH-OI': ce_change,
+        'CE-IV': frame['ce_iv'].to_numpy(),
+        'CE-Delta': frame['ce_delta'].to_numpy(),
+        'CE-Gamma': frame['ce_gamma'].to_numpy(),
+        'CE-Sp': _spread_pct(frame['ce_ask'].to_numpy(), frame['ce_bid'].to_numpy()),
+        'PLTP': frame['pe_ltp'].to_numpy(),
+        'PEOI': pe_oi,
+        'PE-CH-OI': pe_change,
+        'PE-IV': frame['pe_iv'].to_numpy(),
+        'PE-Delta': frame['pe_delta'].to_numpy(),
+        'PE-Gamma': frame['pe_gamma'].to_numpy(),
+        'PE-Sp': _spread_pct(frame['pe_ask'].to_numpy(), frame['pe_bid'].to_numpy()),
+        'PEOI - CEOI': pe_oi - ce_oi,
+        'Trending OI': pe_change - ce_change,
+        'CE Volume': ce_volume,
+        'PE Volume': pe_volume,
+        'Total Volume Difference': pe_volume - ce_volume,
+        'CE-Theta': frame['ce_theta'].to_numpy(),
+        'CE-Vega': frame['ce_vega'].to_numpy(),
+        'PE-Theta': frame['pe_theta'].to_numpy(),
+        'PE-Vega': frame['pe_vega'].to_numpy(),
+    }, columns=ROW_COLUMNS)
+
+
+def detect_interval(strikes):
+    """Most common gap between consecutive listed strikes, or None for fewer than two strikes."""
+    gaps = np.diff(np.unique(np.asarray(strikes, dtype=float)))
+    if gaps.size == 0:
+        return None
+    values, counts = np.unique(np.round(gaps, 6), return_counts=True)
+    interval = float(values[np.argmax(counts)])
+    return int(interval) if interval.is_integer() else interval
+
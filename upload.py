@@ -1,10 +1,23 @@
-import boto3
-from pymongo import MongoClient
+import gzip
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
 from jinja2 import Template
 from pytz import timezone
 import datetime
 import os
 
+from clients import get_mongo_client, get_s3_client as get_shared_s3_client
+from columnar import expand
+from instruments import DEFAULT_UNDERLYING
+from market_calendar import CLOSED, POST_CLOSE, MarketCalendar
+
+try:
+    import brotli
+except ImportError:  # .br siblings are only published when Brotli is installed
+    brotli = None
+
 # MongoDB setup
 MONGO_URI = "mongodb://localhost:27017/"
 DB_NAME = "market_data"
@@ -15,6 +28,14 @@ S3_BUCKET_NAME = "safeguardi.com"    #s3 bucketname
 AWS_REGION = ""            # s3 region 
 AWS_ACCESS_KEY = ""        # IAM  Access key  
 AWS_SECRET_KEY = ""        # IAM Secret access key
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None  # e.g. a local moto server
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "8"))
+
+# Cache headers: the latest objects are revalidated quickly, dated objects of a
+# finished session never change again
+LATEST_CACHE_CONTROL = "public, max-age=60, must-revalidate"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+MARKET_CALENDAR = MarketCalendar()
 
 
 # Template for index.html
@@ -167,7 +188,8 @@ HTML_TEMPLATE = """
 </head>
 <body>
 <div class="container">
-    <h2>Options Data Table</h2>
+    <h2>{{ underlying }} Options Data Table</h2>
+    <p class="subtitle">{{ underlying }} &middot; Expiry {{ expiry }}</p>
     <p>Data last fetched at: {{ timestamp }}</p>
     <p class="subtitle">Live updates of Call and Put options with market sentiment analysis</p>
     
@@ -248,12 +270,21 @@ HTML_TEMPLATE = """
 </html>
 """
 
-def fetch_latest_data():
-    client = MongoClient(MONGO_URI)
-    db = client[DB_NAME]
-    collection = db[COLLECTION_NAME]
-    latest_data = collection.find_one(sort=[("timestamp", -1)])
-    client.close()
+def fetch_latest_data(underlying=DEFAULT_UNDERLYING, expiry=None):
+    """Latest snapshot of `underlying` for `expiry`, by default its nearest expiry that has not passed."""
+    # The pooled client is shared with the rest of the process, so it is not closed here
+    collection = get_mongo_client(MONGO_URI)[DB_NAME][COLLECTION_NAME]
+    if expiry is None:
+        today = datetime.datetime.now(timezone("Asia/Kolkata")).date().isoformat()
+        nearest = collection.find_one(
+            {"underlying": underlying, "expiry": {"$gte": today}},
+            projection={"expiry": 1},
+            sort=[("expiry", 1)],
+        )
+        if not nearest:
+            return None
+        expiry = nearest["expiry"]
+    latest_data = expand(collection.find_one({"underlying": underlying, "expiry": expiry}, sort=[("timestamp", -1)]))
     if latest_data:
         return latest_data
     return None
@@ -267,11 +298,7 @@ def generate_html(data):
     total_oi_pcr = total_pe_oi / total_ce_oi if total_ce_oi != 0 else 0
     total_trending_oi = total_pe_change_oi - total_ce_change_oi
 
-    utc_time = data["timestamp"]
-    if isinstance(utc_time, str):
-        utc_time = datetime.datetime.strptime(utc_time, "%Y-%m-%dT%H:%M:%S.%fZ")
-
-    ist_time = utc_time.replace(tzinfo=timezone("UTC")).astimezone(timezone("Asia/Kolkata"))
+    ist_time = ist_time_of(data)
     formatted_time = ist_time.strftime("%Y-%m-%d %I:%M:%S %p")
 
     # Use atm_strike from the database
@@ -280,8 +307,10 @@ def generate_html(data):
 
     template = Template(HTML_TEMPLATE)
     return template.render(
-        data=data["data"], 
-        timestamp=formatted_time, 
+        data=data["data"],
+        underlying=data["underlying"],
+        expiry=data["expiry"],
+        timestamp=formatted_time,
         atm_strike=atm_strike,
         total_ce_oi=total_ce_oi,
         total_pe_oi=total_pe_oi,
@@ -292,28 +321,121 @@ def generate_html(data):
         total_trending_oi=total_trending_oi
     )
 
-def upload_to_s3(html_content, bucket_name, key):
-    s3_client = boto3.client(
-        "s3",
-        region_name=AWS_REGION,
-        aws_access_key_id=AWS_ACCESS_KEY,
-        aws_secret_access_key=AWS_SECRET_KEY
+def get_s3_client():
+    return get_shared_s3_client(AWS_REGION, S3_ENDPOINT_URL, AWS_ACCESS_KEY, AWS_SECRET_KEY)
+
+def ist_time_of(data):
+    utc_time = data["timestamp"]
+    if isinstance(utc_time, str):
+        utc_time = datetime.datetime.strptime(utc_time, "%Y-%m-%dT%H:%M:%S.%fZ")
+    return utc_time.replace(tzinfo=timezone("UTC")).astimezone(timezone("Asia/Kolkata"))
+
+def generate_json(data):
+    return json.dumps({
+        "underlying": data.get("underlying"),
+        "expiry": data.get("expiry"),
+        "timestamp": ist_time_of(data).isoformat(),
+        "atm_strike": data.get("atm_strike"),
+        "data": data["data"],
+    }, separators=(",", ":"), default=str)
+
+def session_closed(data, calendar=MARKET_CALENDAR):
+    # A dated object only becomes immutable once its trading day is over: the
+    # calendar has left the session (POST_CLOSE, or CLOSED after the closing
+    # minute), with the same phases the refresh scheduler runs on
+    now = calendar.now()
+    if ist_time_of(data).date() < now.date():
+        return True
+    phase = calendar.phase(now)
+    return phase == POST_CLOSE or (phase == CLOSED and now.time() > calendar.market_close)
+
+def build_objects(data, site_default=True):
+    """The latest page and data file plus the per-day archive copies, as (key, body, content type, cache control).
+
+    Every key names the snapshot's underlying and expiry; with `site_default`
+    the page and data file are also published as the site's root index.html
+    and data/latest.json.
+    """
+    html = generate_html(data).encode("utf-8")
+    payload = generate_json(data).encode("utf-8")
+    day = ist_time_of(data).strftime("%Y-%m-%d")
+    pair = f"{data['underlying']}/{data['expiry']}"
+    dated_cache_control = IMMUTABLE_CACHE_CONTROL if session_closed(data) else LATEST_CACHE_CONTROL
+    objects = [
+        (f"{pair}/index.html", html, "text/html; charset=utf-8", LATEST_CACHE_CONTROL),
+        (f"data/{pair}/latest.json", payload, "application/json", LATEST_CACHE_CONTROL),
+        (f"archive/{day}/{pair}/index.html", html, "text/html; charset=utf-8", dated_cache_control),
+        (f"data/{day}/{pair}.json", payload, "application/json", dated_cache_control),
+    ]
+    if site_default:
+        objects += [
+            ("index.html", html, "text/html; charset=utf-8", LATEST_CACHE_CONTROL),
+            ("data/latest.json", payload, "application/json", LATEST_CACHE_CONTROL),
+        ]
+    return objects
+
+def compressed_variants(key, body):
+    # gzip is the canonical object (every client accepts it); brotli goes to a .br
+    # sibling for edges that rewrite on Accept-Encoding. mtime=0 keeps gzip output
+    # stable so identical content hashes identically.
+    variants = [(key, "gzip", gzip.compress(body, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((f"{key}.br", "br", brotli.compress(body, quality=11)))
+    return variants
+
+def is_unchanged(s3_client, bucket_name, key, content_sha256):
+    # Objects carry the sha256 of their uncompressed content as metadata
+    try:
+        head = s3_client.head_object(Bucket=bucket_name, Key=key)
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+    return head.get("Metadata", {}).get("content-sha256") == content_sha256
+
+def upload_object(s3_client, bucket_name, key, encoding, body, content_type, cache_control, content_sha256):
+    """Upload one pre-compressed object unless S3 already holds the same content; returns True if uploaded."""
+    if is_unchanged(s3_client, bucket_name, key, content_sha256):
+        return False
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=key,
+        Body=body,
+        ContentType=content_type,
+        ContentEncoding=encoding,
+        CacheControl=cache_control,
+        Metadata={"content-sha256": content_sha256},
     )
-    s3_client.put_object(Bucket=bucket_name, Key=key, Body=html_content, ContentType="text/html")
+    return True
+
+def publish(data, bucket_name=S3_BUCKET_NAME, s3_client=None, site_default=True):
+    """Upload every changed object for snapshot `data` in parallel; returns (uploaded, skipped) key lists."""
+    s3_client = s3_client or get_s3_client()
+    uploads = []
+    for key, body, content_type, cache_control in build_objects(data, site_default):
+        content_sha256 = hashlib.sha256(body).hexdigest()
+        for variant_key, encoding, compressed in compressed_variants(key, body):
+            uploads.append((variant_key, encoding, compressed, content_type, cache_control, content_sha256))
+
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        results = list(executor.map(lambda upload: upload_object(s3_client, bucket_name, *upload), uploads))
+
+    uploaded = [upload[0] for upload, changed in zip(uploads, results) if changed]
+    skipped = [upload[0] for upload, changed in zip(uploads, results) if not changed]
+    return uploaded, skipped
 
 def main():
     data = fetch_latest_data()
     if not data:
-        print("No data available in MongoDB.")
+        print(f"No data available in MongoDB for {DEFAULT_UNDERLYING}.")
         return
 
-    html_content = generate_html(data)
-
     try:
-        upload_to_s3(html_content, S3_BUCKET_NAME, "index.html")
-        print(f"index.html successfully uploaded to S3 bucket {S3_BUCKET_NAME}.")
+        uploaded, skipped = publish(data)
+        print(f"Uploaded {len(uploaded)} object(s) to S3 bucket {S3_BUCKET_NAME}: {', '.join(uploaded) or 'none'}")
+        print(f"Skipped {len(skipped)} unchanged object(s).")
     except Exception as e:
-        print(f"Failed to upload index.html to S3: {e}")
+        print(f"Failed to publish to S3: {e}")
 
 if __name__ == "__main__":
     main()
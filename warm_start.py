@@ -0,0 +1,149 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from bson import ObjectId
+
+from columnar import compact, expand
+
+# Serving state kept on local disk so a restarted process can serve its last
+# snapshots before MongoDB is reachable.
+#
+# The file is a fixed header (magic, format version, payload length, CRC-32)
+# followed by a JSON payload. It is replaced atomically (temp file, fsync,
+# rename), so a crash mid-save leaves the previous file intact, and it is
+# read through mmap so restoring costs one parse of the payload.
+MAGIC = b'OCWS'
+VERSION = 1
+HEADER = struct.Struct('<4sBQI')  # magic, version, payload length, payload crc32
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        # Full precision: in-memory timestamps keep microseconds, unlike the ones stored in MongoDB
+        return {'$date': value.replace(tzinfo=None).isoformat()}
+    if isinstance(value, ObjectId):
+        return {'$oid': str(value)}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _object_hook(obj):
+    if len(obj) == 1:
+        if '$date' in obj:
+            return datetime.fromisoformat(obj['$date'])
+        if '$oid' in obj:
+            return ObjectId(obj['$oid'])
+    return obj
+
+
+def encode_state(snapshots, history=None):
+    """Payload bytes for the latest snapshot documents (stored layout) and, optionally, IntradayHistory.export()."""
+    state = {
+        'saved_at': datetime.utcnow(),
+        'snapshots': [compact(document) for document in snapshots],
+        'history': history,
+    }
+    return json.dumps(state, default=_default, separators=(',', ':')).encode('utf-8')
+
+
+def decode_state(payload):
+    state = json.loads(payload, object_hook=_object_hook)
+    state['snapshots'] = [expand(document) for document in state['snapshots']]
+    return state
+
+
+class WarmStartFile:
+    def __init__(self, path, collect, interval=1.0):
+        self.path = path
+        self.collect = collect  # () -> (snapshots, history or None)
+        self.interval = interval
+        self.saves = 0
+        self._dirty = threading.Event()
+        self._closing = False
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def save(self):
+        snapshots, history = self.collect()
+        payload = encode_state(snapshots, history)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(prefix='.warm-start-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSION, len(payload), zlib.crc32(payload)))
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self.saves += 1
+
+    def load(self):
+        """The saved state ({'saved_at', 'snapshots', 'history'}), or None if there is no usable file."""
+        try:
+            with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if len(mapped) < HEADER.size:
+                    raise ValueError('truncated header')
+                magic, version, length, checksum = HEADER.unpack_from(mapped)
+                if magic != MAGIC or version != VERSION:
+                    raise ValueError(f'unsupported file (magic {magic!r}, version {version})')
+                payload = mapped[HEADER.size:HEADER.size + length]
+                if len(payload) != length or zlib.crc32(payload) != checksum:
+                    raise ValueError('payload does not match its checksum')
+            return decode_state(payload)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logging.error("Ignoring warm start file %s: %s", self.path, e)
+            return None
+
+    def stats(self):
+        return {'path': self.path, 'saves': self.saves, 'pending': self._dirty.is_set()}
+
+    def schedule(self):
+        """Save soon; saves run in a background thread, at most once per `interval` seconds."""
+        with self._lock:
+            if self._closing:
+                return
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='warm-start-writer', daemon=True)
+                self._thread.start()
+        self._dirty.set()
+
+    def _run(self):
+        while True:
+            self._dirty.wait()
+            if self._closing:
+                return
+            self._dirty.clear()
+            try:
+                self.save()
+            except Exception as e:
+                logging.error("Failed to save warm start file %s: %s", self.path, e)
+            time.sleep(self.interval)
+
+    def close(self):
+        """Stop the writer, saving once more if a save was pending."""
+        with self._lock:
+            self._closing = True
+            thread = self._thread
+        pending = self._dirty.is_set()
+        self._dirty.set()
+        if thread is None:
+            return
+        thread.join(self.interval + 5)
+        self._dirty.clear()
+        if pending:
+            try:
+                self.save()
+            except Exception as e:
+                logging.error("Failed to save warm start file %s: %s", self.path, e)
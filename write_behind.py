@@ -0,0 +1,222 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from metrics import WRITE_BATCH_SECONDS, WRITES_DROPPED
+from resilience import retry_delay
+
+DUPLICATE_KEY = 11000
+
+
+# Background persistence for SnapshotStore.
+#
+# Snapshots are handed over with their _id already assigned and written by a
+# single thread, which waits `flush_interval` seconds after the first pending
+# write so every snapshot of a tick goes in one batch: one unordered
+# insert_many for the snapshots, one unordered bulk_write for checked_at
+# bumps and one for the bucket samples, which are merged per bucket first.
+#
+# At most `max_pending` writes are held; beyond that the oldest are dropped,
+# so a MongoDB outage costs history but never memory or live serving. Failed
+# snapshot batches are retried with backoff (re-inserts of documents that
+# made it are ignored as duplicates); bucket samples are best-effort and
+# not retried, so a retry never pushes a sample twice. `on_drop(document)` is
+# called for every snapshot dropped without being written.
+class WriteBehindQueue:
+    def __init__(self, collection, bucket_collection=None, max_pending=500, batch_size=200, flush_interval=0.2,
+                 retry_base_delay=1, on_drop=None):
+        self.collection = collection
+        self.bucket_collection = bucket_collection
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_base_delay = retry_base_delay
+        self.on_drop = on_drop
+        self.written = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self._pending = deque()
+        self._in_flight = 0
+        self._flushing = 0
+        self._closing = False
+        self._thread = None
+        self._cond = threading.Condition()
+
+    def insert(self, document, samples=()):
+        """Queue a snapshot insert; `samples` are (bucket filter, sample) pairs pushed alongside it."""
+        self._submit(('insert', document, list(samples)))
+
+    def touch(self, _id, checked_at):
+        """Queue a `checked_at` bump for the stored snapshot `_id`."""
+        self._submit(('touch', _id, checked_at))
+
+    def _submit(self, entry):
+        with self._cond:
+            if self._closing:
+                logging.error("Write-behind queue is closed; dropping a %s", entry[0])
+                self._drop([entry])
+                return
+            self._pending.append(entry)
+            self._trim()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='snapshot-writer', daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _trim(self):
+        excess = len(self._pending) - self.max_pending
+        if excess > 0:
+            dropped = [self._pending.popleft() for _ in range(excess)]
+            logging.warning("Write-behind queue full; dropped the %d oldest pending writes", excess)
+            self._drop(dropped)
+
+    def _drop(self, entries):
+        self.dropped += len(entries)
+        WRITES_DROPPED.inc(len(entries))
+        if self.on_drop is None:
+            return
+        for entry in entries:
+            if entry[0] == 'insert':
+                try:
+                    self.on_drop(entry[1])
+                except Exception as e:
+                    logging.error("Write-behind drop callback failed: %s", e)
+
+    def pending(self):
+        with self._cond:
+            return len(self._pending) + self._in_flight
+
+    def flush(self, timeout=None):
+        """Wait until every queued write has been attempted; False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flushing += 1  # Skip the batching delay meanwhile
+            self._cond.notify_all()
+            try:
+                while self._pending or self._in_flight:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._flushing -= 1
+        return True
+
+    def close(self, timeout=10):
+        """Write what is pending (one attempt) and stop the writer thread."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                logging.error("Write-behind queue did not drain within %s seconds; %d writes lost", timeout, self.pending())
+
+    def _take(self):
+        with self._cond:
+            while not self._pending and not self._closing:
+                self._cond.wait()
+            if not self._pending:
+                return None
+            # Let the rest of this tick's snapshots arrive
+            deadline = time.monotonic() + self.flush_interval
+            while not (self._closing or self._flushing) and len(self._pending) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            self._in_flight = len(batch)
+            return batch
+
+    def _run(self):
+        failures = 0
+        while True:
+            batch = self._take()
+            if batch is None:
+                return
+            start = time.perf_counter()
+            written = self._write(batch)
+            WRITE_BATCH_SECONDS.observe(time.perf_counter() - start, outcome='written' if written else 'failed')
+            with self._cond:
+                self._in_flight = 0
+                if written:
+                    self.written += len(batch)
+                else:
+                    self.failed_batches += 1
+                    if self._closing:
+                        lost = batch + list(self._pending)
+                        logging.error("MongoDB unavailable at shutdown; dropping %d pending writes", len(lost))
+                        self._pending.clear()
+                        self._drop(lost)
+                        self._cond.notify_all()
+                        return
+                    self._pending.extendleft(reversed(batch))
+                    self._trim()
+                self._cond.notify_all()
+            if written:
+                failures = 0
+                continue
+            failures += 1
+            with self._cond:
+                self._cond.wait(retry_delay(min(failures - 1, 5), self.retry_base_delay))
+
+    def _write(self, batch):
+        inserts = []
+        touches = {}  # _id -> latest checked_at
+        buckets = {}  # bucket key -> (filter, [sample, ...])
+        for entry in batch:
+            if entry[0] == 'insert':
+                inserts.append(entry[1])
+                for bucket, sample in entry[2]:
+                    key = tuple(bucket.values())
+                    buckets.setdefault(key, (bucket, []))[1].append(sample)
+            else:
+                touches[entry[1]] = max(entry[2], touches.get(entry[1], entry[2]))
+
+        try:
+            if inserts:
+                self._insert_many(inserts)
+            if touches:
+                self.collection.bulk_write(
+                    [UpdateOne({'_id': _id}, {'$max': {'checked_at': checked_at}}) for _id, checked_at in touches.items()],
+                    ordered=False,
+                )
+        except PyMongoError as e:
+            logging.error("Failed to write %d snapshots to MongoDB, will retry: %s", len(batch), e)
+            return False
+
+        if buckets and self.bucket_collection is not None:
+            try:
+                self.bucket_collection.bulk_write([
+                    UpdateOne(bucket, {'$push': {'samples': {'$each': samples}}, '$inc': {'count': len(samples)}},
+                              upsert=True)
+                    for bucket, samples in buckets.values()
+                ], ordered=False)
+            except PyMongoError as e:
+                # The full snapshots are stored; bucket samples are best-effort
+                logging.error("Failed to append bucket samples: %s", e)
+        return True
+
+    def _insert_many(self, documents):
+        try:
+            self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # Documents stored by an earlier, partly failed attempt come back as duplicates
+            errors = [error for error in e.details.get('writeErrors', []) if error.get('code') != DUPLICATE_KEY]
+            if errors or e.details.get('writeConcernErrors'):
+                raise
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending': len(self._pending) + self._in_flight,
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed_batches': self.failed_batches,
+            }
@@ -0,0 +1,10 @@
+# Production entry point:
+#
+#     gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Each worker imports this module after forking, so every worker has its own
+# scheduler and snapshot caches; the MongoDB leader lease makes sure only one
+# of them calls the Dhan API while the rest serve reads.
+from app import app, start_background_jobs
+
+start_background_jobs()